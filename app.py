@@ -1,9 +1,23 @@
 import streamlit as st
 import os
 import json
-import random
-from typing import Dict, List, Any
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any, Iterator, Mapping, Optional, Sequence, Set, Tuple
 from datetime import datetime
+from chat_history import SPILL_DIR_ENV_VAR, ChatHistory
+from conversation import ConversationState
+from facet_index import FacetIndex
+from fact_sampler import FactSampler, SampleCursor
+from fact_cards import FACTS_PER_PAGE, FactCardCache, page_count
+from intent_classifier import INTENT_LEXICON, Intent, IntentClassifier
+from knowledge_store import KnowledgeStore, get_store, next_version, registry
+from llm_backend import OpenAIBackend, create_backend_from_env
+from response_cache import ResponseCache, normalize_query
+from search_index import InvertedIndex, STOPWORDS, tokenize
+from spelling import COMMON_WORDS, MIN_CORRECTION_LENGTH, SpellingCorrector, is_slip
 
 # Page configuration
 st.set_page_config(
@@ -13,247 +27,683 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Suggested questions shown as buttons on the chat page
+SUGGESTED_QUESTIONS = [
+    "Tell me about Japanese business etiquette",
+    "What are some Indian greeting customs?",
+    "How do Germans view punctuality?",
+    "What should I know about dining in France?",
+    "Explain Chinese lucky numbers"
+]
+
+# How many of the most asked questions to precompute, how often to refresh them,
+# and how many distinct questions to keep counting
+POPULAR_QUESTION_COUNT = 10
+POPULAR_REFRESH_INTERVAL = 100
+MAX_TRACKED_QUESTIONS = 10000
+
+# Chat messages shown per page of history; older ones load on request
+CHAT_WINDOW_SIZE = 20
+
+# Minimum seconds between redraws of a response that is still streaming in
+STREAM_RENDER_INTERVAL = 0.1
+
+# Record kinds whose text only feeds the spelling vocabulary; facts come from the index
+SPELLING_SECTION_KINDS = ("festival", "location", "language", "etiquette")
+
+# Hybrid search: per-stage time budget in seconds, worker threads per stage and the
+# reciprocal-rank fusion constant
+HYBRID_STAGE_BUDGET = 0.05
+HYBRID_STAGE_WORKERS = 4
+RRF_K = 60
+
+# Response wording for the intents that have their own framing
+RESPONSE_TEMPLATES = {
+    "greeting": "Regarding greetings in {country}: {fact} This reflects the cultural values of respect and social harmony that are important in {country}.",
+    "business": "For business practices in {country}: {fact} Understanding these customs is crucial for successful professional relationships.",
+    "food": "About dining culture in {country}: {fact} Food customs often reflect deeper cultural values and social structures.",
+}
+DEFAULT_RESPONSE_TEMPLATE = "Here's an important cultural insight about {country}: {fact} This practice is rooted in the cultural values and traditions of the region."
+
+def section_fact(kind: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Present a store record in the fact shape responses are built from"""
+    if kind == "festival":
+        return {"country": record['country'], "fact": f"{record['name']} ({record['season']}): {record['description']}",
+                "category": "festivals", "source": "Festivals"}
+    if kind == "location":
+        return {"country": record['country'], "fact": f"{record['name']} ({record['type']}): {record['description']}",
+                "category": "locations", "source": "Best Locations"}
+    return record
+
 # Cultural Database Class
 class CulturalDatabase:
-    def __init__(self):
-        self.cultural_facts = [
-            {
-                "country": "Japan",
-                "fact": "In Japan, it's considered rude to blow your nose in public. People excuse themselves to do it privately.",
-                "category": "etiquette",
-                "source": "Japanese Cultural Studies"
-            },
-            {
-                "country": "Japan",
-                "fact": "Japanese business cards (meishi) are exchanged with both hands and should be received with respect and careful examination.",
-                "category": "business",
-                "source": "Japanese Business Etiquette Guide"
-            },
-            {
-                "country": "India",
-                "fact": "India has 22 official languages and over 1,600 spoken languages, making it one of the most linguistically diverse countries.",
-                "category": "language",
-                "source": "Indian Linguistic Survey"
-            },
-            {
-                "country": "India",
-                "fact": "In Indian culture, touching someone's feet is a sign of respect, especially for elders and teachers.",
-                "category": "greeting",
-                "source": "Indian Cultural Traditions"
-            },
-            {
-                "country": "Brazil",
-                "fact": "Brazilians typically hug and kiss on the cheek when greeting, even in business settings.",
-                "category": "greeting",
-                "source": "Brazilian Social Customs"
-            },
-            {
-                "country": "Brazil",
-                "fact": "In Brazil, the 'OK' hand gesture is considered offensive, similar to giving someone the middle finger.",
-                "category": "etiquette",
-                "source": "Brazilian Cultural Guide"
-            },
-            {
-                "country": "Germany",
-                "fact": "Germans value punctuality so much that being late is considered very disrespectful, even by a few minutes.",
-                "category": "business",
-                "source": "German Business Culture"
-            },
-            {
-                "country": "Germany",
-                "fact": "In Germany, it's customary to maintain eye contact during toasts and say 'Prost' or 'Zum Wohl'.",
-                "category": "food",
-                "source": "German Dining Etiquette"
-            },
-            {
-                "country": "China",
-                "fact": "In Chinese culture, the number 8 is considered extremely lucky because it sounds like the word for 'prosperity'.",
-                "category": "beliefs",
-                "source": "Chinese Numerology Studies"
-            },
-            {
-                "country": "China",
-                "fact": "When receiving a business card in China, accept it with both hands and take a moment to read it carefully.",
-                "category": "business",
-                "source": "Chinese Business Etiquette"
-            },
-            {
-                "country": "France",
-                "fact": "French people typically don't eat meals while walking or standing - dining is seen as a social ritual to be savored.",
-                "category": "food",
-                "source": "French Culinary Culture"
-            },
-            {
-                "country": "France",
-                "fact": "In France, it's polite to greet shopkeepers with 'Bonjour' when entering and 'Au revoir' when leaving.",
-                "category": "etiquette",
-                "source": "French Social Customs"
-            },
-            {
-                "country": "South Korea",
-                "fact": "In Korea, you should use both hands when giving or receiving business cards as a sign of respect.",
-                "category": "business",
-                "source": "Korean Business Protocol"
-            },
-            {
-                "country": "South Korea",
-                "fact": "Korean age calculation includes the time spent in the womb, so Koreans are typically 1-2 years older in 'Korean age'.",
-                "category": "general",
-                "source": "Korean Cultural Practices"
-            },
-            {
-                "country": "Mexico",
-                "fact": "Mexican families often have multiple generations living together, and family loyalty is highly valued.",
-                "category": "family",
-                "source": "Mexican Family Structures"
-            },
-            {
-                "country": "Mexico",
-                "fact": "In Mexico, personal space is smaller than in many Western cultures, and people stand closer during conversations.",
-                "category": "etiquette",
-                "source": "Mexican Social Norms"
-            },
-            {
-                "country": "Egypt",
-                "fact": "In Egypt, showing the sole of your foot to someone is considered offensive, so keep feet flat on the ground when sitting.",
-                "category": "etiquette",
-                "source": "Egyptian Cultural Guidelines"
-            },
-            {
-                "country": "Egypt",
-                "fact": "Egyptian hospitality is legendary - guests are often offered tea or coffee multiple times as a sign of welcome.",
-                "category": "food",
-                "source": "Egyptian Hospitality Traditions"
-            },
-            {
-                "country": "Russia",
-                "fact": "Russians believe that smiling without reason is insincere, so don't be surprised by serious expressions in public.",
-                "category": "expression",
-                "source": "Russian Social Behavior"
-            },
-            {
-                "country": "Russia",
-                "fact": "In Russia, it's traditional to remove shoes when entering someone's home, and slippers are often provided for guests.",
-                "category": "etiquette",
-                "source": "Russian Home Customs"
-            },
-            {
-                "country": "Thailand",
-                "fact": "In Thailand, the head is considered sacred, so never touch someone's head, even children.",
-                "category": "etiquette",
-                "source": "Thai Cultural Sensitivities"
-            },
-            {
-                "country": "Thailand",
-                "fact": "Thai people use the 'wai' greeting - pressing palms together and bowing slightly - as a sign of respect.",
-                "category": "greeting",
-                "source": "Thai Greeting Customs"
-            },
-            {
-                "country": "Italy",
-                "fact": "In Italy, cappuccino is traditionally only drunk in the morning, never after meals.",
-                "category": "food",
-                "source": "Italian Coffee Culture"
-            },
-            {
-                "country": "Italy",
-                "fact": "Italians often speak with their hands, and gestures are an integral part of communication.",
-                "category": "language",
-                "source": "Italian Communication Styles"
-            }
-        ]
+    def __init__(self, store: Optional[KnowledgeStore] = None):
+        # Facts are read from the shared knowledge store, so every database over it sees the
+        # facts any of them added
+        self.store = store if store is not None else get_store()
+        # Country and category bitsets for combined filtering and facet counts
+        self._facets = FacetIndex.from_store(self.store)
+        # Random facts are weighted so each country comes up about as often as any other
+        self.sampler = FactSampler(self._facets, balance_countries=True)
+        # Replaced whenever the facts change so caches built on them can be invalidated;
+        # versions are unique across databases, so one built for a swapped-in store never matches
+        self._version = next_version()
+        self._sync_lock = threading.Lock()
+        # Vector index over the store, built on the first semantic search
+        self.semantic_index = None
+        self._semantic_lock = threading.Lock()
+        # Worker threads for the lexical and semantic hybrid search stages, one pool per stage
+        # so a stage that overruns its budget only ties up its own workers
+        self._stage_pools: Optional[Tuple[ThreadPoolExecutor, ThreadPoolExecutor]] = None
+        self._stage_pools_lock = threading.Lock()
+        # Typo-tolerant vocabulary of indexed terms, place names, intent words, section text
+        # and everyday words, built on the first miss; steering terms are the place names and
+        # intent words among them
+        self._spelling: Optional[SpellingCorrector] = None
+        self._steering_terms: Set[str] = set()
+        
+        # Search with the store's index, building it once if the store has none yet;
+        # the store keeps it up to date as facts are added
+        if self.store.fact_index is None:
+            index = InvertedIndex()
+            for fact_id, fact in enumerate(self.store.get_records("fact")):
+                index.add(fact_id, fact)
+            self.store.fact_index = index
+        self.index = self.store.fact_index
+    
+    @property
+    def cultural_facts(self) -> Sequence[Mapping[str, Any]]:
+        """Every fact record in the store, by fact id"""
+        return self.store.get_records("fact")
+    
+    @property
+    def facets(self) -> FacetIndex:
+        self._sync()
+        return self._facets
+    
+    @property
+    def version(self) -> int:
+        self._sync()
+        return self._version
+    
+    def _fact(self, fact_id: int) -> Mapping[str, Any]:
+        return self.store.records[self.store.by_kind["fact"][fact_id]]
+    
+    def _sync(self) -> None:
+        """Take in facts added to the store since this database last looked, through it or another one"""
+        if self.store.read_only or self._facets.size >= len(self.store.by_kind["fact"]):
+            return
+        with self._sync_lock:
+            for fact_id in range(self._facets.size, len(self.store.by_kind["fact"])):
+                record = self._fact(fact_id)
+                self._facets.add(record)
+                if self._spelling is not None:
+                    for term in tokenize(f"{record['fact']} {record['country']} {record['category']}"):
+                        self._spelling.add(term)
+            # The semantic index is re-embedded on next use so new facts can be retrieved
+            self.semantic_index = None
+            self._version = next_version()
+    
+    def add_fact(self, fact: Dict[str, Any]) -> None:
+        """Add a cultural fact to the knowledge store, which indexes it, and to the views built on it"""
+        self.store.add_fact(fact)
+        self._sync()
+    
+    def _get_spelling(self) -> SpellingCorrector:
+        if self._spelling is None:
+            spelling = SpellingCorrector()
+            for term, fact_ids in self.index.postings.items():
+                spelling.add(term, len(fact_ids))
+            # Place names and intent words steer which countries and sections are searched
+            steering_terms = {term for surface in self.store.entities.entities for term in tokenize(surface[0])}
+            steering_terms.update(form for words in INTENT_LEXICON.values() for word in words
+                                  for form in (word, word + "s"))
+            for term in steering_terms:
+                spelling.add(term)
+            # Section text and everyday words are known too, so they are not mistaken for typos
+            for kind in SPELLING_SECTION_KINDS:
+                for record_id in self.store.select(kind):
+                    for string_id in (self.store.text_ids[record_id], self.store.category_ids[record_id],
+                                      self.store.source_ids[record_id]):
+                        for term in tokenize(self.store.strings[string_id]):
+                            spelling.add(term)
+            for word in COMMON_WORDS:
+                spelling.add(word)
+            self._steering_terms = steering_terms
+            self._spelling = spelling
+        return self._spelling
+    
+    def correct_query(self, query: str) -> str:
+        """Replace misspelled place names and intent words in a query with their known spelling
+        
+        Only steering terms are corrected towards, and only for a dropped or swapped letter:
+        an unknown word near some other known word ("bring" and "being", "shorts" and "sports")
+        is more likely a real word the data lacks than a typo, and rewriting it would change
+        which countries and sections the question is answered from.
+        """
+        words = tokenize(query)
+        corrected = False
+        for position, word in enumerate(words):
+            if len(word) < MIN_CORRECTION_LENGTH or word in STOPWORDS or self.index.has_prefix(word):
+                continue
+            suggestion = self._get_spelling().lookup(word)
+            if suggestion is None or suggestion not in self._steering_terms or not is_slip(word, suggestion):
+                continue
+            words[position] = suggestion
+            corrected = True
+        return " ".join(words) if corrected else query
     
     def search_facts(self, query: str) -> List[Dict[str, Any]]:
         """Search for relevant cultural facts based on query"""
-        query_lower = query.lower()
-        relevant_facts = []
-        
-        # Search by country
-        for fact in self.cultural_facts:
-            if fact['country'].lower() in query_lower:
-                relevant_facts.append(fact)
-        
-        # Search by category
-        if not relevant_facts:
-            for fact in self.cultural_facts:
-                if fact['category'].lower() in query_lower:
-                    relevant_facts.append(fact)
-        
-        # Search by keywords in fact content
-        if not relevant_facts:
-            keywords = query_lower.split()
-            for fact in self.cultural_facts:
-                fact_text = fact['fact'].lower()
-                if any(keyword in fact_text for keyword in keywords):
-                    relevant_facts.append(fact)
-        
-        return relevant_facts[:5]
-    
-    def get_random_fact(self) -> Dict[str, Any]:
-        """Get a random cultural fact"""
-        return random.choice(self.cultural_facts)
+        query = self.correct_query(query)
+        # Without a recognized country the index scans the query for its own country names
+        countries = self.store.entities.countries(query) or None
+        fact_ids = self.index.search(query, limit=5, countries=countries)
+        return [self._fact(fact_id) for fact_id in fact_ids]
+    
+    def rank_facts(self, query: str, k: int = 5) -> List[Tuple[Dict[str, Any], float]]:
+        """Rank cultural facts against a query with BM25, best first"""
+        query = self.correct_query(query)
+        return [(self._fact(fact_id), score) for fact_id, score in self.index.rank(query, k)]
+    
+    def _get_semantic_index(self):
+        """Build or load the vector index on first use"""
+        if self.semantic_index is None:
+            with self._semantic_lock:
+                if self.semantic_index is None:
+                    # NumPy is only needed once semantic search is actually used
+                    from semantic_index import load_semantic_index
+                    self.semantic_index = load_semantic_index(self.store)
+        return self.semantic_index
+    
+    def semantic_search(self, query: str, k: int = 5) -> List[Tuple[Dict[str, Any], float]]:
+        """Find facts and festivals similar in meaning to a query, best first"""
+        results = self._get_semantic_index().search(query, k)
+        return [(self.store.records[record_id], score) for record_id, score in results]
+    
+    def _semantic_facts(self, query: str, k: int) -> List[Tuple[Dict[str, Any], float]]:
+        """Semantic search restricted to cultural facts"""
+        results = self._get_semantic_index().search(query, k * 2)
+        return [(self.store.records[record_id], score) for record_id, score in results
+                if self.store.kind_of(record_id) == "fact"][:k]
+    
+    def hybrid_search(self, query: str, k: int = 5, lexical_budget: float = HYBRID_STAGE_BUDGET,
+                      semantic_budget: float = HYBRID_STAGE_BUDGET) -> List[Tuple[Dict[str, Any], float]]:
+        """Fuse BM25 and semantic fact rankings with reciprocal-rank fusion, best first
+        
+        Both stages run concurrently, each under its own time budget. A stage that misses
+        its budget or fails contributes nothing, so the other stage's results are returned
+        alone. A stage still queued when its budget runs out is cancelled; one already running
+        finishes in the background on its stage's own pool.
+        """
+        if self._stage_pools is None:
+            with self._stage_pools_lock:
+                if self._stage_pools is None:
+                    self._stage_pools = (
+                        ThreadPoolExecutor(max_workers=HYBRID_STAGE_WORKERS, thread_name_prefix="lexical"),
+                        ThreadPoolExecutor(max_workers=HYBRID_STAGE_WORKERS, thread_name_prefix="semantic"),
+                    )
+        lexical_pool, semantic_pool = self._stage_pools
+        started = time.monotonic()
+        stages = [
+            (lexical_pool.submit(self.rank_facts, query, k * 2), lexical_budget),
+            (semantic_pool.submit(self._semantic_facts, query, k * 2), semantic_budget),
+        ]
+        
+        fused: Dict[Tuple[str, str], List[Any]] = {}
+        for future, budget in stages:
+            try:
+                ranking = future.result(timeout=max(0.0, budget - (time.monotonic() - started)))
+            except Exception:
+                future.cancel()
+                continue
+            for rank, (fact, _) in enumerate(ranking):
+                entry = fused.setdefault((fact['country'], fact['fact']), [fact, 0.0])
+                entry[1] += 1.0 / (RRF_K + rank + 1)
+        
+        return sorted((tuple(entry) for entry in fused.values()), key=lambda item: item[1], reverse=True)[:k]
+    
+    def search_sections(self, intent: Intent, countries: List[str], k: int = 5) -> List[Dict[str, Any]]:
+        """Get records from the store sections an intent points at, for the given countries or all of them"""
+        results = []
+        for country in countries or [None]:
+            for kind, category in intent.sections:
+                for record in self.store.get_records(kind, country=country, category=category):
+                    results.append(section_fact(kind, record))
+                    if len(results) == k:
+                        return results
+        return results
+    
+    def compare_countries(self, countries: List[str], intent: Optional[Intent] = None,
+                          per_country: int = 2) -> Dict[str, List[Dict[str, Any]]]:
+        """Get up to `per_country` records for each country from one pass over their postings
+        
+        Records from the intent's sections come first; general cultural facts fill any gap.
+        """
+        sections = list(intent.sections) if intent is not None else []
+        section_ranks = {section: rank for rank, section in enumerate(sections)}
+        candidates: Dict[str, List[Tuple[int, int, str]]] = {country: [] for country in countries}
+        for country in countries:
+            for record_id in self.store.by_country.get(country.lower(), []):
+                kind = self.store.kind_of(record_id)
+                category = self.store.strings[self.store.category_ids[record_id]].lower()
+                rank = section_ranks.get((kind, category), section_ranks.get((kind, None)))
+                if rank is None and kind == "fact":
+                    rank = len(sections)
+                if rank is not None:
+                    candidates[country].append((rank, record_id, kind))
+        
+        return {country: [section_fact(kind, self.store.records[record_id])
+                          for _, record_id, kind in sorted(ranked)[:per_country]]
+                for country, ranked in candidates.items()}
+    
+    def get_random_fact(self, country: Optional[str] = None, category: Optional[str] = None,
+                        cursor: Optional[SampleCursor] = None) -> Dict[str, Any]:
+        """Get a random cultural fact, optionally filtered; with a cursor, one it has not returned yet"""
+        self._sync()
+        if cursor is not None:
+            fact_id = cursor.next(self.sampler, country, category)
+        else:
+            fact_id = self.sampler.sample(country, category)
+        if fact_id is None:
+            raise IndexError("No cultural facts match the given filters")
+        return self._fact(fact_id)
     
     def get_facts_by_country(self, country: str) -> List[Dict[str, Any]]:
         """Get all facts for a specific country"""
-        return [fact for fact in self.cultural_facts if fact['country'].lower() == country.lower()]
+        return self.filter_facts(country=country)
     
     def get_facts_by_category(self, category: str) -> List[Dict[str, Any]]:
         """Get all facts for a specific category"""
-        return [fact for fact in self.cultural_facts if fact['category'].lower() == category.lower()]
+        return self.filter_facts(category=category)
     
-    def get_all_countries(self) -> List[str]:
-        """Get list of all countries in the database"""
-        return list(set(fact['country'] for fact in self.cultural_facts))
+    def filter_facts(self, country: Optional[str] = None, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get the facts matching every given filter"""
+        return [self._fact(fact_id) for fact_id in self.facets.filter(country, category)]
     
-    def get_all_categories(self) -> List[str]:
-        """Get list of all categories in the database"""
-        return list(set(fact['category'] for fact in self.cultural_facts))
+    def facet_counts(self, country: Optional[str] = None,
+                     category: Optional[str] = None) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Get fact counts per country and per category under the other facet's filter"""
+        return self.facets.facet_counts(country, category)
+    
+    def get_all_countries(self) -> Sequence[str]:
+        """Get the sorted countries in the database, maintained as facts change"""
+        return self.facets.countries.values
+    
+    def get_all_categories(self) -> Sequence[str]:
+        """Get the sorted categories in the database, maintained as facts change"""
+        return self.facets.categories.values
+
+# One database per knowledge store, shared by CultureAI and the pages and rebuilt when the store is swapped
+registry.register("database", CulturalDatabase)
+
+# Writes an answer from a question and its facts, or returns None to use the templates
+TextGenerator = Callable[[str, List[Dict[str, Any]]], Optional[str]]
+
+
+class DeferredGeneration:
+    """Stands in for the LLM backend while a streamed response is built
+
+    It records the request the backend would have answered, and where the finished answer
+    belongs in the response cache, so the answer can be streamed once the rest is ready.
+    """
+
+    def __init__(self):
+        self.request: Optional[Tuple[str, List[Dict[str, Any]]]] = None
+        self.cache_entry: Optional[Tuple[str, int]] = None
+
+    def __call__(self, user_message: str, facts: List[Dict[str, Any]]) -> Optional[str]:
+        self.request = (user_message, facts)
+        return None
+
 
 # Simple AI Response Generator (without OpenAI dependency)
 class CultureAI:
-    def __init__(self):
-        self.cultural_db = CulturalDatabase()
+    def __init__(self, retrieval_mode: str = "keyword", cache_size: int = 1024, cache_ttl: float = 3600.0,
+                 backend: Optional[OpenAIBackend] = None, cultural_db: Optional[CulturalDatabase] = None):
+        # "keyword" keeps the country/category/keyword precedence, "ranked" uses BM25 scores,
+        # "hybrid" fuses BM25 with semantic search
+        if retrieval_mode not in ("keyword", "ranked", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        self.retrieval_mode = retrieval_mode
+        # Optional language model; the templates below are used when it is absent or fails
+        self.backend = backend
+        self.intent_classifier = IntentClassifier()
+        # A fixed database, or None to follow the registry's current one across swaps
+        self._cultural_db = cultural_db
+        self.response_cache = ResponseCache(max_size=cache_size, ttl=cache_ttl)
+        
+        # Ready-made answers for suggested and popular questions, keyed by normalized query
+        self.precomputed: Dict[str, Dict[str, Any]] = {}
+        self.precomputed_questions: List[str] = []
+        self._precomputed_version: Optional[int] = None
+        self.question_counts: Counter = Counter()
+        self._questions_since_refresh = 0
+        self._questions_lock = threading.Lock()
+        # Held while a background refresh runs, so at most one rebuild is in flight
+        self._refresh_lock = threading.Lock()
+    
+    @property
+    def cultural_db(self) -> CulturalDatabase:
+        """The database to answer from; each request looks it up once and uses it throughout"""
+        return self._cultural_db if self._cultural_db is not None else registry.get("database")
+    
+    def warm_up(self, questions: List[str]) -> None:
+        """Precompute answers for the given questions and the most popular ones asked so far"""
+        self.precomputed_questions = list(questions)
+        self._refresh_precomputed(self.cultural_db)
+    
+    def _refresh_precomputed(self, db: CulturalDatabase) -> None:
+        """Rebuild the precomputed answers against the current facts"""
+        # Stamp the answers with the version they start from, so facts added meanwhile trigger another rebuild
+        version = db.version
+        with self._questions_lock:
+            popular = [question for question, _ in self.question_counts.most_common(POPULAR_QUESTION_COUNT)]
+        precomputed = {}
+        for question in self.precomputed_questions + popular:
+            key = normalize_query(question)
+            if key in precomputed:
+                continue
+            response, cacheable = self._build_cacheable(question, db, None, self._generate_text)
+            if cacheable:
+                precomputed[key] = response
+        # Swap in the finished dict so concurrent readers never see a partial set
+        self.precomputed = precomputed
+        self._precomputed_version = version
+    
+    def _schedule_refresh(self, db: CulturalDatabase) -> None:
+        """Rebuild the precomputed answers on a background thread unless a rebuild is already running"""
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        with self._questions_lock:
+            self._questions_since_refresh = 0
+        threading.Thread(target=self._run_refresh, args=(db,), name="precompute-refresh", daemon=True).start()
+    
+    def _run_refresh(self, db: CulturalDatabase) -> None:
+        """Background body of a scheduled refresh"""
+        try:
+            self._refresh_precomputed(db)
+        finally:
+            self._refresh_lock.release()
+    
+    def _track_question(self, key: str, db: CulturalDatabase) -> None:
+        """Count a question towards the popular set, refreshing the set periodically"""
+        with self._questions_lock:
+            self.question_counts[key] += 1
+            if len(self.question_counts) > MAX_TRACKED_QUESTIONS:
+                self.question_counts = Counter(dict(self.question_counts.most_common(MAX_TRACKED_QUESTIONS // 10)))
+            self._questions_since_refresh += 1
+            due = self._questions_since_refresh >= POPULAR_REFRESH_INTERVAL
+        if due:
+            self._schedule_refresh(db)
+        
+    def generate_response(self, user_message: str, conversation: Optional[ConversationState] = None,
+                          fact_cursor: Optional[SampleCursor] = None) -> Dict[str, Any]:
+        """Generate response based on cultural database, reusing cached answers
+        
+        With a conversation, follow-up questions are answered from the records cached for
+        the countries under discussion, and the conversation moves on to each new answer's countries.
+        A fact cursor keeps random-fact fallbacks from repeating within a session.
+        """
+        return self._respond(user_message, conversation, fact_cursor, self._generate_text)
+    
+    def _respond(self, user_message: str, conversation: Optional[ConversationState],
+                 fact_cursor: Optional[SampleCursor], generate_text: TextGenerator) -> Dict[str, Any]:
+        """Answer a message, as a follow-up when it is one, writing answers with generate_text"""
+        # Take the database once, so a store swap mid-request cannot mix two datasets
+        db = self.cultural_db
+        if conversation is None:
+            return self._generate(user_message, db, fact_cursor, generate_text)
+        
+        follow_up = self._answer_follow_up(user_message, conversation, db, generate_text)
+        if follow_up is not None:
+            return follow_up
+        response = self._generate(user_message, db, conversation.fact_cursor, generate_text)
+        conversation.remember(db.store, response["countries"])
+        return response
+    
+    def _generate_text(self, user_message: str, facts: List[Dict[str, Any]]) -> Optional[str]:
+        """Let the LLM backend write the answer, or return None to use the templates"""
+        return self.backend.generate(user_message, facts) if self.backend is not None else None
+    
+    def _generate(self, user_message: str, db: CulturalDatabase, fact_cursor: Optional[SampleCursor],
+                  generate_text: TextGenerator) -> Dict[str, Any]:
+        """Answer from the precomputed set or the response cache, building the answer on a miss"""
+        key = normalize_query(user_message)
+        # Answers precomputed against another store are rebuilt in the background, not used
+        precomputed_current = self._precomputed_version == db.version
+        if self._precomputed_version is not None and not precomputed_current:
+            self._schedule_refresh(db)
+        self._track_question(key, db)
+        
+        precomputed = self.precomputed.get(key) if precomputed_current else None
+        if precomputed is not None:
+            return dict(precomputed)
+        
+        cached = self.response_cache.get(key, db.version)
+        if cached is not None:
+            return dict(cached)
+        
+        response, cacheable = self._build_cacheable(user_message, db, fact_cursor, generate_text)
+        if cacheable:
+            if isinstance(generate_text, DeferredGeneration) and generate_text.request is not None:
+                # The answer is still to be streamed; it is cached once it has been written
+                generate_text.cache_entry = (key, db.version)
+            else:
+                self.response_cache.put(key, db.version, response)
+        return dict(response)
+    
+    def stream_response(self, user_message: str, conversation: Optional[ConversationState] = None,
+                        fact_cursor: Optional[SampleCursor] = None) -> Iterator[str]:
+        """Yield the response text as it is produced
+        
+        Precomputed, cached and template answers come out in one piece. With an LLM backend the
+        answer is streamed as the model writes it, falling back to the template answer if the
+        backend fails before writing anything.
+        """
+        deferred = DeferredGeneration()
+        response = self._respond(user_message, conversation, fact_cursor,
+                                 deferred if self.backend is not None else self._generate_text)
+        if deferred.request is None:
+            yield response["response"]
+            return
+        
+        chunks = []
+        try:
+            for chunk in self.backend.generate_stream(*deferred.request):
+                chunks.append(chunk)
+                yield chunk
+        except Exception:
+            if not chunks:
+                yield response["response"]
+            return
+        if not chunks:
+            yield response["response"]
+        elif deferred.cache_entry is not None:
+            self.response_cache.put(*deferred.cache_entry, {**response, "response": "".join(chunks)})
+    
+    def _build_cacheable(self, user_message: str, db: CulturalDatabase, fact_cursor: Optional[SampleCursor],
+                         generate_text: TextGenerator) -> Tuple[Dict[str, Any], bool]:
+        """Build a response and report whether it may be cached or precomputed
+        
+        Random-fact fallbacks are left out so repeated questions still vary, and so are template
+        answers written because the LLM backend failed, so the question reaches it again.
+        """
+        # With a backend, no text means the backend failed; a deferred generation returns
+        # none on purpose, and its answer is cached once it has been streamed
+        expects_text = self.backend is not None and not isinstance(generate_text, DeferredGeneration)
+        failures = []
+        
+        def generate(message: str, facts: List[Dict[str, Any]]) -> Optional[str]:
+            text = generate_text(message, facts)
+            if text is None and expects_text:
+                failures.append(message)
+            return text
+        
+        response, used_fallback = self._build_response(user_message, db, fact_cursor, generate)
+        return response, not used_fallback and not failures
+    
+    def _build_response(self, user_message: str, db: CulturalDatabase, fact_cursor: Optional[SampleCursor],
+                        generate_text: TextGenerator) -> Tuple[Dict[str, Any], bool]:
+        """Build a response from scratch; also report whether it is a random-fact fallback"""
+        query = db.correct_query(user_message)
+        countries = db.store.entities.countries(query)
+        intent = self.intent_classifier.classify(query)
+        if len(countries) > 1:
+            return self._build_comparison(user_message, countries, intent, db, generate_text), False
         
-    def generate_response(self, user_message: str) -> Dict[str, Any]:
-        """Generate response based on cultural database"""
         # Get relevant cultural facts from database
-        relevant_facts = self.cultural_db.search_facts(user_message)
+        scores = []
+        if self.retrieval_mode == "ranked":
+            ranked_facts = db.rank_facts(user_message, k=5)
+            relevant_facts = [fact for fact, _ in ranked_facts]
+            scores = [score for _, score in ranked_facts]
+        elif self.retrieval_mode == "hybrid":
+            relevant_facts = [fact for fact, _ in db.hybrid_search(user_message, k=5)]
+        else:
+            relevant_facts = db.search_facts(user_message)
+        
+        # Steer towards the data sections the question is about, for the countries it names
+        # or else the countries retrieval found
+        if intent is not None:
+            if not countries:
+                countries = list(dict.fromkeys(fact['country'] for fact in relevant_facts))
+            section_facts = db.search_sections(intent, countries, k=5)
+            if section_facts:
+                seen = {(fact['country'], fact['fact']) for fact in section_facts}
+                relevant_facts = (section_facts + [fact for fact in relevant_facts
+                                                   if (fact['country'], fact['fact']) not in seen])[:5]
         
         if relevant_facts:
-            # Use the most relevant fact
-            fact = relevant_facts[0]
-            
-            # Generate contextual response
-            if "greeting" in user_message.lower():
-                response = f"Regarding greetings in {fact['country']}: {fact['fact']} This reflects the cultural values of respect and social harmony that are important in {fact['country']}."
-            elif "business" in user_message.lower():
-                response = f"For business practices in {fact['country']}: {fact['fact']} Understanding these customs is crucial for successful professional relationships."
-            elif "food" in user_message.lower() or "dining" in user_message.lower():
-                response = f"About dining culture in {fact['country']}: {fact['fact']} Food customs often reflect deeper cultural values and social structures."
-            else:
-                response = f"Here's an important cultural insight about {fact['country']}: {fact['fact']} This practice is rooted in the cultural values and traditions of the region."
-            
-            # Add additional context if multiple facts are available
-            if len(relevant_facts) > 1:
-                response += f"\n\nAdditionally, it's worth noting that cultural practices can vary within {fact['country']}, and these customs may differ between regions or generations."
+            response = self._compose_answer(user_message, relevant_facts, intent, generate_text)
+            countries = [relevant_facts[0]['country']]
         else:
             # Fallback response
-            random_fact = self.cultural_db.get_random_fact()
+            random_fact = db.get_random_fact(cursor=fact_cursor)
+            countries = [random_fact['country']]
             response = f"While I don't have specific information about that topic, here's an interesting cultural fact about {random_fact['country']}: {random_fact['fact']} Feel free to ask about specific countries or cultural practices!"
         
+        if scores:
+            # Squash the best BM25 score into (0, 1); it is kept when section facts lead the
+            # answer, since it still measures how well the question matched the data
+            confidence = round(scores[0] / (scores[0] + 1.0), 2)
+        else:
+            confidence = 0.8 if relevant_facts else 0.6
+        
         return {
             "response": response,
-            "confidence": 0.8 if relevant_facts else 0.6,
+            "confidence": confidence,
             "sources": [fact['source'] for fact in relevant_facts[:3]] if relevant_facts else ["Cultural Database"],
-            "category": relevant_facts[0]['category'] if relevant_facts else "general"
+            "category": relevant_facts[0]['category'] if relevant_facts else "general",
+            "countries": countries
+        }, not relevant_facts
+    
+    def _compose_answer(self, user_message: str, relevant_facts: List[Dict[str, Any]], intent: Optional[Intent],
+                        generate_text: TextGenerator) -> str:
+        """Word an answer around the most relevant fact, or let the LLM backend write it"""
+        # Use the most relevant fact
+        fact = relevant_facts[0]
+        generated = generate_text(user_message, relevant_facts)
+        if generated:
+            return generated
+        
+        # Generate contextual response
+        template = RESPONSE_TEMPLATES.get(intent.name if intent else None, DEFAULT_RESPONSE_TEMPLATE)
+        response = template.format(country=fact['country'], fact=fact['fact'])
+        
+        # Add additional context if multiple facts are available
+        if len(relevant_facts) > 1:
+            response += f"\n\nAdditionally, it's worth noting that cultural practices can vary within {fact['country']}, and these customs may differ between regions or generations."
+        return response
+    
+    def _answer_follow_up(self, user_message: str, conversation: ConversationState, db: CulturalDatabase,
+                          generate_text: TextGenerator) -> Optional[Dict[str, Any]]:
+        """Answer a follow-up from the conversation's cached candidates, or None if it is not one
+        
+        A follow-up names no country, so it never moves the conversation to other countries.
+        """
+        store = db.store
+        query = db.correct_query(user_message)
+        # Follow-up cues are matched as typed, since spelling correction may rewrite them
+        if not conversation.is_follow_up(user_message, store.entities.countries(query)):
+            return None
+        
+        intent = self.intent_classifier.classify(query)
+        countries = conversation.countries
+        per_country = 5 if len(countries) == 1 else 2
+        # Cached candidates from before a store swap point into the old store's records
+        conversation.remember(store, countries)
+        ids_by_country = conversation.next_candidates(store, intent, per_country)
+        if not any(ids_by_country.values()) and intent is not None:
+            # Nothing on that topic for these countries, so stay on them with their general facts,
+            # worded without the topic's framing
+            intent = None
+            ids_by_country = conversation.next_candidates(store, None, per_country)
+        if not any(ids_by_country.values()):
+            # The store holds nothing for these countries, so answer from all of it, but
+            # without remembering the answer's countries in their place
+            return self._generate(user_message, db, conversation.fact_cursor, generate_text)
+        for record_ids in ids_by_country.values():
+            conversation.mark_used(record_ids)
+        facts_by_country = {country: [section_fact(store.kind_of(record_id), store.records[record_id])
+                                      for record_id in record_ids]
+                            for country, record_ids in ids_by_country.items()}
+        
+        if len(countries) > 1:
+            return self._build_comparison(user_message, countries, intent, db, generate_text, facts_by_country)
+        relevant_facts = facts_by_country[countries[0]]
+        return {
+            "response": self._compose_answer(user_message, relevant_facts, intent, generate_text),
+            "confidence": 0.8,
+            "sources": [fact['source'] for fact in relevant_facts[:3]],
+            "category": relevant_facts[0]['category'],
+            "countries": countries
+        }
+
+    def _build_comparison(self, user_message: str, countries: List[str], intent: Optional[Intent], db: CulturalDatabase,
+                          generate_text: TextGenerator,
+                          facts_by_country: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+        """Build a side-by-side answer for a question naming several countries"""
+        if facts_by_country is None:
+            facts_by_country = db.compare_countries(countries, intent)
+        relevant_facts = [fact for facts in facts_by_country.values() for fact in facts]
+        generated = generate_text(user_message, relevant_facts)
+        
+        if generated:
+            response = generated
+        else:
+            response = f"Here's how {', '.join(countries[:-1])} and {countries[-1]} compare:"
+            for country, facts in facts_by_country.items():
+                if facts:
+                    response += f"\n\n{country}: " + " ".join(fact['fact'].rstrip('.') + "." for fact in facts)
+                else:
+                    response += f"\n\n{country}: I don't have specific information about this yet."
+        
+        return {
+            "response": response,
+            "confidence": 0.8 if all(facts_by_country.values()) else 0.6,
+            "sources": list(dict.fromkeys(fact['source'] for fact in relevant_facts))[:3] or ["Cultural Database"],
+            "category": intent.name if intent is not None else "comparison",
+            "countries": countries
         }
 
 # Initialize components
 @st.cache_resource
 def initialize_components():
-    return CultureAI(), CulturalDatabase()
+    culture_ai = CultureAI(backend=create_backend_from_env())
+    # Answer the suggestion buttons ahead of time so a click is a dictionary lookup
+    culture_ai.warm_up(SUGGESTED_QUESTIONS)
+    return culture_ai
 
-culture_ai, cultural_db = initialize_components()
+culture_ai = initialize_components()
+# The same database CultureAI answers from; looked up on every rerun so a swapped-in store shows at once
+cultural_db = registry.get("database")
+
+@st.cache_resource
+def get_fact_card_cache():
+    return FactCardCache()
+
+fact_card_cache = get_fact_card_cache()
 
 # Custom CSS for beautiful styling
 st.markdown("""
@@ -314,6 +764,10 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Per-session conversation state, shared by the chat page and the sidebar's random facts
+if "conversation" not in st.session_state:
+    st.session_state.conversation = ConversationState()
+
 # Sidebar with app information
 with st.sidebar:
     st.markdown("""
@@ -342,20 +796,32 @@ with st.sidebar:
     # Quick stats
     st.markdown("### 📊 Quick Stats")
     st.success("🟢 System Online")
-    st.info(f"📈 {len(cultural_db.cultural_facts)} Cultural Facts")
+    st.info(f"📈 {cultural_db.facets.count()} Cultural Facts")
     st.info(f"🌍 {len(cultural_db.get_all_countries())} Countries")
     
     # Random fact
     st.markdown("### 🎲 Random Fact")
     if st.button("Get Random Fact"):
-        fact = cultural_db.get_random_fact()
-        st.markdown(f"""
-        <div class="fact-card">
-            <h4>{fact['country']}</h4>
-            <p>{fact['fact']}</p>
-            <small>Category: {fact['category']}</small>
+        fact = cultural_db.get_random_fact(cursor=st.session_state.conversation.fact_cursor)
+        st.markdown(fact_card_cache.card(fact, cultural_db.version, compact=True), unsafe_allow_html=True)
+
+def format_chat_message(role: str, content: str) -> str:
+    """HTML for one chat message"""
+    if role == "user":
+        return f"""
+        <div class="chat-message user-message">
+            <strong>You:</strong> {content}
         </div>
-        """, unsafe_allow_html=True)
+        """
+    return f"""
+        <div class="chat-message bot-message">
+            <strong>CultureBot:</strong> {content}
+        </div>
+        """
+
+def render_chat_message(role: str, content: str, container: Any = st) -> None:
+    """Render one chat message, optionally into a placeholder that is being updated"""
+    container.markdown(format_chat_message(role, content), unsafe_allow_html=True)
 
 # Main content area
 if page == "🏠 Home":
@@ -414,62 +880,51 @@ elif page == "💬 Chat with CultureBot":
     """, unsafe_allow_html=True)
     
     # Initialize chat history
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    
-    # Display chat messages
-    for message in st.session_state.messages:
-        if message["role"] == "user":
-            st.markdown(f"""
-            <div class="chat-message user-message">
-                <strong>You:</strong> {message["content"]}
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.markdown(f"""
-            <div class="chat-message bot-message">
-                <strong>CultureBot:</strong> {message["content"]}
-            </div>
-            """, unsafe_allow_html=True)
+    if "history" not in st.session_state:
+        st.session_state.history = ChatHistory(spill_dir=os.environ.get(SPILL_DIR_ENV_VAR))
+        st.session_state.history_window = CHAT_WINDOW_SIZE
+    history = st.session_state.history
+    
+    # Display the most recent chat messages as one block
+    start = max(history.first_available, len(history) - st.session_state.history_window)
+    if start > history.first_available and st.button("Show earlier messages"):
+        st.session_state.history_window += CHAT_WINDOW_SIZE
+        st.rerun()
+    if len(history):
+        st.markdown("".join(format_chat_message(role, content) for role, content in history.messages(start, len(history))),
+                    unsafe_allow_html=True)
     
-    # Chat input
+    # Chat input; suggestion buttons queue their question for the next run
     user_input = st.chat_input("Ask about any culture or country...")
+    question = user_input or st.session_state.pop("pending_question", None)
     
-    if user_input:
+    if question:
         # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": user_input})
+        history.append("user", question)
+        render_chat_message("user", question)
         
-        # Get bot response
-        with st.spinner("CultureBot is thinking..."):
-            bot_response = culture_ai.generate_response(user_input)
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": bot_response["response"]
-            })
-        
-        st.rerun()
+        # Stream the bot response into place as it is produced, redrawing at most every
+        # STREAM_RENDER_INTERVAL seconds
+        placeholder = st.empty()
+        chunks = []
+        rendered_at = 0.0
+        for chunk in culture_ai.stream_response(question, st.session_state.conversation):
+            chunks.append(chunk)
+            if time.monotonic() - rendered_at >= STREAM_RENDER_INTERVAL:
+                render_chat_message("assistant", "".join(chunks), placeholder)
+                rendered_at = time.monotonic()
+        render_chat_message("assistant", "".join(chunks), placeholder)
+        history.append("assistant", "".join(chunks))
     
     # Suggested questions
     st.markdown("### 💡 Try asking about:")
-    suggestions = [
-        "Tell me about Japanese business etiquette",
-        "What are some Indian greeting customs?",
-        "How do Germans view punctuality?",
-        "What should I know about dining in France?",
-        "Explain Chinese lucky numbers"
-    ]
+    suggestions = SUGGESTED_QUESTIONS
     
     cols = st.columns(len(suggestions))
     for i, suggestion in enumerate(suggestions):
         with cols[i]:
             if st.button(suggestion, key=f"suggestion_{i}", use_container_width=True):
-                st.session_state.messages.append({"role": "user", "content": suggestion})
-                with st.spinner("CultureBot is thinking..."):
-                    bot_response = culture_ai.generate_response(suggestion)
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": bot_response["response"]
-                    })
+                st.session_state.pending_question = suggestion
                 st.rerun()
 
 elif page == "📚 Cultural Facts":
@@ -484,34 +939,36 @@ elif page == "📚 Cultural Facts":
     # Filters
     col1, col2 = st.columns(2)
     
+    # Option labels carry overall counts; they must not change between reruns or the
+    # selectbox would reset its choice
+    country_counts, category_counts = cultural_db.facet_counts()
+    
     with col1:
-        countries = ["All Countries"] + sorted(cultural_db.get_all_countries())
-        country_filter = st.selectbox("Filter by Country:", countries)
+        countries = ["All Countries", *cultural_db.get_all_countries()]
+        country_filter = st.selectbox("Filter by Country:", countries, key="country_filter",
+                                      format_func=lambda option: f"{option} ({country_counts.get(option, 0)})"
+                                      if option in country_counts else option)
     
     with col2:
-        categories = ["All Categories"] + sorted(cultural_db.get_all_categories())
-        category_filter = st.selectbox("Filter by Category:", categories)
-    
-    # Display facts
-    if country_filter != "All Countries":
-        facts = cultural_db.get_facts_by_country(country_filter)
-    elif category_filter != "All Categories":
-        facts = cultural_db.get_facts_by_category(category_filter)
-    else:
-        facts = cultural_db.cultural_facts
+        categories = ["All Categories", *cultural_db.get_all_categories()]
+        category_filter = st.selectbox("Filter by Category:", categories, key="category_filter",
+                                       format_func=lambda option: f"{option} ({category_counts.get(option, 0)})"
+                                       if option in category_counts else option)
+    
+    # Display facts matching both filters
+    facts = cultural_db.filter_facts(
+        None if country_filter == "All Countries" else country_filter,
+        None if category_filter == "All Categories" else category_filter,
+    )
     
     if facts:
-        for fact in facts:
-            st.markdown(f"""
-            <div class="fact-card">
-                <h3>{fact['country']}</h3>
-                <p>{fact['fact']}</p>
-                <div style="display: flex; justify-content: space-between; margin-top: 1rem;">
-                    <small><strong>Category:</strong> {fact['category']}</small>
-                    <small><strong>Source:</strong> {fact['source']}</small>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+        # Large results are split into pages, each rendered as one cached block
+        pages = page_count(len(facts))
+        page_number = st.number_input("Page", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+        first = (page_number - 1) * FACTS_PER_PAGE
+        st.caption(f"Showing {first + 1}-{min(first + FACTS_PER_PAGE, len(facts))} of {len(facts)} facts")
+        st.markdown(fact_card_cache.page((country_filter, category_filter), facts, page_number, cultural_db.version),
+                    unsafe_allow_html=True)
     else:
         st.info("No facts found for the selected filters.")
 
@@ -534,7 +991,7 @@ else:  # About page
         
         ### 🔧 Technology Stack
         - **Frontend**: Streamlit (Python)
-        - **AI Engine**: Rule-based cultural knowledge system
+        - **AI Engine**: Rule-based cultural knowledge system, with an optional OpenAI-compatible model
         - **Database**: In-memory cultural facts database
         - **Deployment**: Hugging Face Spaces
         """)
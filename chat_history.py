@@ -0,0 +1,92 @@
+"""
+Chat History for CultureBot
+Capped per-session message store that keeps recent turns in memory and can spill older ones to disk
+"""
+
+import json
+import os
+import tempfile
+import weakref
+from array import array
+from collections import deque
+from typing import List, Optional, Tuple
+
+DEFAULT_HISTORY_LIMIT = 200
+
+# Environment variable naming a directory for older turns; without it they are dropped
+SPILL_DIR_ENV_VAR = "CULTUREBOT_CHAT_SPILL_DIR"
+
+# Messages are stored as (role id, content) pairs
+ROLES = ("user", "assistant")
+
+
+def _remove_file(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class ChatHistory:
+    """Messages in order, at most `max_messages` of them in memory
+
+    Messages pushed out of memory are appended to a JSON lines file when a spill
+    directory is given, and can still be read back by position; otherwise they are dropped.
+    """
+
+    def __init__(self, max_messages: int = DEFAULT_HISTORY_LIMIT, spill_dir: Optional[str] = None):
+        self.max_messages = max_messages
+        self.spill_dir = spill_dir
+        self.recent: deque = deque()
+        # Number of messages that have left memory, and how many of those were dropped
+        self.evicted = 0
+        self.dropped = 0
+        self.spill_path: Optional[str] = None
+        self.spill_offsets = array('Q')
+
+    def __len__(self) -> int:
+        return self.evicted + len(self.recent)
+
+    @property
+    def first_available(self) -> int:
+        """Position of the oldest message that can still be read"""
+        return self.dropped
+
+    def append(self, role: str, content: str) -> None:
+        """Add a message, moving the oldest one out of memory once the cap is reached"""
+        self.recent.append((ROLES.index(role), content))
+        if len(self.recent) > self.max_messages:
+            self._evict(self.recent.popleft())
+
+    def _evict(self, message: Tuple[int, str]) -> None:
+        self.evicted += 1
+        if self.spill_dir is None:
+            self.dropped += 1
+            return
+        if self.spill_path is None:
+            handle, self.spill_path = tempfile.mkstemp(prefix="culturebot-chat-", suffix=".jsonl", dir=self.spill_dir)
+            os.close(handle)
+            # Delete the file along with the session's history
+            weakref.finalize(self, _remove_file, self.spill_path)
+        with open(self.spill_path, "ab") as spill_file:
+            self.spill_offsets.append(spill_file.tell())
+            spill_file.write(json.dumps(message).encode("utf-8") + b"\n")
+
+    def messages(self, start: int, stop: int) -> List[Tuple[str, str]]:
+        """Get (role, content) for positions start..stop-1, reading spilled ones from disk"""
+        start = max(start, self.first_available)
+        stop = min(stop, len(self))
+        results: List[Tuple[str, str]] = []
+        if start < self.evicted:
+            with open(self.spill_path, "rb") as spill_file:
+                spill_file.seek(self.spill_offsets[start - self.dropped])
+                for _ in range(start, min(stop, self.evicted)):
+                    role_id, content = json.loads(spill_file.readline())
+                    results.append((ROLES[role_id], content))
+            start = self.evicted
+        for position in range(start - self.evicted, stop - self.evicted):
+            role_id, content = self.recent[position]
+            results.append((ROLES[role_id], content))
+        return results
+
+    def window(self, count: int) -> List[Tuple[str, str]]:
+        """Get the most recent `count` messages"""
+        return self.messages(len(self) - count, len(self))
@@ -0,0 +1,94 @@
+"""
+Context Builder for CultureBot
+Scores candidate snippets for a question and packs the best ones into a token budget for the LLM prompt
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Any, Mapping, Optional, Sequence, Tuple
+
+from knowledge_store import KnowledgeStore, get_store
+from search_index import STOPWORDS, tokenize
+
+DEFAULT_TOKEN_BUDGET = 400
+
+# Store sections added as context for the countries the retrieved facts are about
+CONTEXT_KINDS = ("festival", "language", "etiquette")
+
+# Countries, taken in retrieval order, whose extra sections are considered
+MAX_CONTEXT_COUNTRIES = 2
+
+# Rough stand-in for a BPE tokenizer: words and individual punctuation marks
+TOKEN_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Approximate prompt token count of a snippet, cached per snippet"""
+    return len(TOKEN_PIECE_PATTERN.findall(text))
+
+
+@lru_cache(maxsize=8192)
+def _snippet_terms(text: str) -> frozenset:
+    return frozenset(tokenize(text))
+
+
+def format_snippet(kind: str, record: Mapping[str, Any]) -> str:
+    """Render a store record as a single context line"""
+    if kind == "festival":
+        return f"{record['country']} festival - {record['name']} ({record['season']}): {record['description']}"
+    if kind == "language":
+        return f"{record['country']} language: {record['fact']}"
+    if kind == "etiquette":
+        return f"{record['country']} dining etiquette: {record['fact']}"
+    return f"{record['country']} ({record['category']}): {record['fact']}"
+
+
+class ContextBuilder:
+    """Chooses which facts and country sections go into a prompt"""
+
+    def __init__(self, store: Optional[KnowledgeStore] = None, token_budget: int = DEFAULT_TOKEN_BUDGET):
+        # A fixed store, or None to follow the registry's current one across swaps
+        self._store = store
+        self.token_budget = token_budget
+
+    @property
+    def store(self) -> KnowledgeStore:
+        return self._store if self._store is not None else get_store()
+
+    def candidates(self, facts: Sequence[Mapping[str, Any]]) -> List[Tuple[str, float]]:
+        """Snippets for the retrieved facts and their countries' sections, with a retrieval prior"""
+        snippets: Dict[str, float] = {}
+        countries: List[str] = []
+        for rank, fact in enumerate(facts):
+            # Earlier retrieval results get a larger head start
+            snippets.setdefault(format_snippet("fact", fact), 1.0 / (1 + rank))
+            if fact['country'] not in countries:
+                countries.append(fact['country'])
+
+        store = self.store
+        for country in countries[:MAX_CONTEXT_COUNTRIES]:
+            for kind in CONTEXT_KINDS:
+                for record in store.get_records(kind, country=country):
+                    snippets.setdefault(format_snippet(kind, record), 0.0)
+        return list(snippets.items())
+
+    def build(self, query: str, facts: Sequence[Mapping[str, Any]]) -> List[str]:
+        """Pick the highest scoring snippets that fit in the token budget"""
+        query_terms = {term for term in tokenize(query) if term not in STOPWORDS}
+        scored = []
+        for text, prior in self.candidates(facts):
+            overlap = len(query_terms & _snippet_terms(text))
+            scored.append((overlap + prior, text))
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        selected = []
+        remaining = self.token_budget
+        for score, text in scored:
+            if score <= 0:
+                break
+            tokens = count_tokens(text)
+            if tokens <= remaining:
+                selected.append(text)
+                remaining -= tokens
+        return selected
@@ -0,0 +1,92 @@
+"""
+Conversation State for CultureBot
+Per-session memory of the countries under discussion, so follow-up questions narrow cached candidates
+"""
+
+import re
+import weakref
+from array import array
+from collections import deque
+from typing import Dict, List, Optional
+
+from fact_sampler import SampleCursor
+from intent_classifier import Intent
+from knowledge_store import KnowledgeStore
+
+# Memory bounds for a single session
+MAX_CONVERSATION_COUNTRIES = 3
+MAX_CANDIDATES = 256
+MAX_RECENT_RECORDS = 32
+
+# "what about their food?", "and in terms of etiquette?", "do they tip there?"
+FOLLOW_UP_PATTERN = re.compile(r"^\s*(?:and|what about|how about)\b|\b(?:they|their|theirs|them|there)\b",
+                               re.IGNORECASE)
+
+
+class ConversationState:
+    """The countries a session is talking about, their candidate record ids and recently used ids"""
+
+    def __init__(self):
+        self.countries: List[str] = []
+        self.candidate_ids = array('I')
+        # The store the candidate ids index into, held weakly so a swapped-out store can be freed
+        self._store_ref: Optional[weakref.ref] = None
+        self.recent_ids: deque = deque(maxlen=MAX_RECENT_RECORDS)
+        # Random facts shown this session, so they do not repeat until all have been seen
+        self.fact_cursor = SampleCursor()
+
+    def is_follow_up(self, message: str, countries: List[str]) -> bool:
+        """Whether a message names no country of its own but refers back to the current ones"""
+        return bool(self.countries) and not countries and FOLLOW_UP_PATTERN.search(message) is not None
+
+    def remember(self, store: KnowledgeStore, countries: List[str]) -> None:
+        """Make `countries` the subject of the conversation and cache their candidate records
+
+        The candidates are fetched again for the same countries when `store` has replaced the one they came from.
+        """
+        countries = countries[:MAX_CONVERSATION_COUNTRIES]
+        same_store = self._store_ref is not None and self._store_ref() is store
+        if not countries or (countries == self.countries and same_store):
+            return
+        self.countries = countries
+        self._store_ref = weakref.ref(store)
+        self.candidate_ids = array('I')
+        for country in countries:
+            ids = store.by_country.get(country.lower(), [])
+            self.candidate_ids.extend(ids[:MAX_CANDIDATES // len(countries)])
+        self.recent_ids.clear()
+
+    def mark_used(self, record_ids: List[int]) -> None:
+        """Remember record ids that were just shown so later follow-ups move on to new ones"""
+        self.recent_ids.extend(record_ids)
+
+    def narrow(self, store: KnowledgeStore, intent: Optional[Intent], per_country: int,
+               skip_used: bool = True) -> Dict[str, List[int]]:
+        """Get unused candidate ids in the intent's sections, or general facts without one, per country"""
+        sections = list(intent.sections) if intent is not None else [("fact", None)]
+        section_ranks = {section: rank for rank, section in enumerate(sections)}
+        recent = set(self.recent_ids) if skip_used else set()
+
+        ranked: Dict[str, List] = {country: [] for country in self.countries}
+        for record_id in self.candidate_ids:
+            if record_id in recent:
+                continue
+            kind = store.kind_of(record_id)
+            category = store.strings[store.category_ids[record_id]].lower()
+            rank = section_ranks.get((kind, category), section_ranks.get((kind, None)))
+            country = store.strings[store.country_ids[record_id]]
+            if rank is not None and country in ranked:
+                ranked[country].append((rank, record_id))
+
+        return {country: [record_id for _, record_id in sorted(matches)[:per_country]]
+                for country, matches in ranked.items()}
+
+    def next_candidates(self, store: KnowledgeStore, intent: Optional[Intent], per_country: int) -> Dict[str, List[int]]:
+        """Narrow to unused candidates, going round them again once every one has been shown"""
+        ids_by_country = self.narrow(store, intent, per_country)
+        if not any(ids_by_country.values()):
+            ids_by_country = self.narrow(store, intent, per_country, skip_used=False)
+            if any(ids_by_country.values()):
+                # Start over on the same countries rather than leave them for new ones
+                self.recent_ids.clear()
+        return ids_by_country
@@ -3,7 +3,8 @@ Cultural Data Repository for CultureBot
 Contains comprehensive cultural information for countries worldwide
 """
 
-from typing import Dict, List, Any
+from datetime import date
+from typing import Dict, List, Any, Mapping, Sequence
 
 # Comprehensive cultural data structure
 CULTURAL_DATA = {
@@ -581,9 +582,115 @@ CULTURAL_DATA = {
                 "Tea is continuously refilled for guests"
             ]
         }
+    },
+    
+    "South Korea": {
+        "cultural_facts": [
+            {
+                "fact": "In Korea, you should use both hands when giving or receiving business cards as a sign of respect.",
+                "category": "business",
+                "source": "Korean Business Protocol"
+            },
+            {
+                "fact": "Korean age calculation includes the time spent in the womb, so Koreans are typically 1-2 years older in 'Korean age'.",
+                "category": "general",
+                "source": "Korean Cultural Practices"
+            }
+        ]
+    },
+    
+    "Mexico": {
+        "cultural_facts": [
+            {
+                "fact": "Mexican families often have multiple generations living together, and family loyalty is highly valued.",
+                "category": "family",
+                "source": "Mexican Family Structures"
+            },
+            {
+                "fact": "In Mexico, personal space is smaller than in many Western cultures, and people stand closer during conversations.",
+                "category": "etiquette",
+                "source": "Mexican Social Norms"
+            }
+        ]
+    },
+    
+    "Egypt": {
+        "cultural_facts": [
+            {
+                "fact": "In Egypt, showing the sole of your foot to someone is considered offensive, so keep feet flat on the ground when sitting.",
+                "category": "etiquette",
+                "source": "Egyptian Cultural Guidelines"
+            },
+            {
+                "fact": "Egyptian hospitality is legendary - guests are often offered tea or coffee multiple times as a sign of welcome.",
+                "category": "food",
+                "source": "Egyptian Hospitality Traditions"
+            }
+        ]
+    },
+    
+    "Russia": {
+        "cultural_facts": [
+            {
+                "fact": "Russians believe that smiling without reason is insincere, so don't be surprised by serious expressions in public.",
+                "category": "expression",
+                "source": "Russian Social Behavior"
+            },
+            {
+                "fact": "In Russia, it's traditional to remove shoes when entering someone's home, and slippers are often provided for guests.",
+                "category": "etiquette",
+                "source": "Russian Home Customs"
+            }
+        ]
+    },
+    
+    "Thailand": {
+        "cultural_facts": [
+            {
+                "fact": "In Thailand, the head is considered sacred, so never touch someone's head, even children.",
+                "category": "etiquette",
+                "source": "Thai Cultural Sensitivities"
+            },
+            {
+                "fact": "Thai people use the 'wai' greeting - pressing palms together and bowing slightly - as a sign of respect.",
+                "category": "greeting",
+                "source": "Thai Greeting Customs"
+            }
+        ]
+    },
+    
+    "Italy": {
+        "cultural_facts": [
+            {
+                "fact": "In Italy, cappuccino is traditionally only drunk in the morning, never after meals.",
+                "category": "food",
+                "source": "Italian Coffee Culture"
+            },
+            {
+                "fact": "Italians often speak with their hands, and gestures are an integral part of communication.",
+                "category": "language",
+                "source": "Italian Communication Styles"
+            }
+        ]
     }
 }
 
+# Demonyms and other names people use for each country in questions
+DEMONYMS = {
+    "Japan": ["Japanese"],
+    "India": ["Indian", "Indians"],
+    "Brazil": ["Brazilian", "Brazilians"],
+    "Germany": ["German", "Germans"],
+    "France": ["French"],
+    "China": ["Chinese"],
+    "South Korea": ["Korean", "Koreans", "Korea"],
+    "Mexico": ["Mexican", "Mexicans"],
+    "Egypt": ["Egyptian", "Egyptians"],
+    "Russia": ["Russian", "Russians"],
+    "Thailand": ["Thai"],
+    "Italy": ["Italian", "Italians"]
+}
+
 def get_all_countries() -> List[str]:
     """Get list of all countries in the database"""
     return list(CULTURAL_DATA.keys())
@@ -592,49 +699,36 @@ def get_country_data(country: str) -> Dict[str, Any]:
     """Get all data for a specific country"""
     return CULTURAL_DATA.get(country, {})
 
-def search_by_category(category: str) -> List[Dict[str, Any]]:
+def search_by_category(category: str) -> Sequence[Mapping[str, Any]]:
     """Search cultural facts by category across all countries"""
-    results = []
-    for country, data in CULTURAL_DATA.items():
-        if 'cultural_facts' in data:
-            for fact in data['cultural_facts']:
-                if fact['category'].lower() == category.lower():
-                    fact_with_country = fact.copy()
-                    fact_with_country['country'] = country
-                    results.append(fact_with_country)
-    return results
+    from knowledge_store import get_store
+    return get_store().get_records("fact", category=category)
 
-def get_all_cultural_facts() -> List[Dict[str, Any]]:
+def get_all_cultural_facts() -> Sequence[Mapping[str, Any]]:
     """Get all cultural facts from all countries"""
-    all_facts = []
-    for country, data in CULTURAL_DATA.items():
-        if 'cultural_facts' in data:
-            for fact in data['cultural_facts']:
-                fact_with_country = fact.copy()
-                fact_with_country['country'] = country
-                all_facts.append(fact_with_country)
-    return all_facts
+    from knowledge_store import get_store
+    return get_store().get_records("fact")
 
-def get_festivals_by_season(season: str) -> List[Dict[str, Any]]:
+def get_festivals_by_season(season: str) -> Sequence[Mapping[str, Any]]:
     """Get festivals by season across all countries"""
-    results = []
-    for country, data in CULTURAL_DATA.items():
-        if 'festivals' in data:
-            for festival in data['festivals']:
-                if season.lower() in festival['season'].lower():
-                    festival_with_country = festival.copy()
-                    festival_with_country['country'] = country
-                    results.append(festival_with_country)
-    return results
+    from knowledge_store import get_store
+    store = get_store()
+    if season.strip().lower() in store.calendar.by_season:
+        return store.calendar.festivals_by_season(season)
+    # Anything other than a season name is matched against the raw season text
+    return store.get_records("festival", category_contains=season)
+
+def get_festivals_by_month(month: int) -> Sequence[Mapping[str, Any]]:
+    """Get festivals taking place at least partly in a month (1-12)"""
+    from knowledge_store import get_store
+    return get_store().calendar.festivals_by_month(month)
+
+def get_festivals_between(start: date, end: date) -> Sequence[Mapping[str, Any]]:
+    """Get festivals overlapping a date range, such as the dates of a trip"""
+    from knowledge_store import get_store
+    return get_store().calendar.festivals_between(start, end)
 
-def search_locations_by_type(location_type: str) -> List[Dict[str, Any]]:
+def search_locations_by_type(location_type: str) -> Sequence[Mapping[str, Any]]:
     """Search best locations by type across all countries"""
-    results = []
-    for country, data in CULTURAL_DATA.items():
-        if 'best_locations' in data:
-            for location in data['best_locations']:
-                if location_type.lower() in location['type'].lower():
-                    location_with_country = location.copy()
-                    location_with_country['country'] = country
-                    results.append(location_with_country)
-    return results
+    from knowledge_store import get_store
+    return get_store().get_records("location", category_contains=location_type)
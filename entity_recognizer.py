@@ -0,0 +1,124 @@
+"""
+Entity Recognizer for CultureBot
+Aho-Corasick matcher resolving countries, demonyms, capitals and places in a query in one scan
+"""
+
+import re
+from collections import deque
+from typing import Dict, List, Iterable, NamedTuple, Tuple
+
+from cultural_data import CULTURAL_DATA, DEMONYMS
+
+# Place highlights that are also everyday words and would match far too often
+AMBIGUOUS_NAMES = frozenset({"nice", "carnival", "gardens"})
+
+NAME_SPLIT_PATTERN = re.compile(r"\s*(?:&|\(|\))\s*")
+
+
+class Entity(NamedTuple):
+    """A gazetteer match in a query"""
+    surface: str
+    country: str
+    kind: str
+    start: int
+    end: int
+
+
+def _place_names(name: str) -> List[str]:
+    """Split "Eiffel Tower & Paris" or "French Riviera (Côte d'Azur)" into separate names"""
+    return [part for part in NAME_SPLIT_PATTERN.split(name) if part]
+
+
+def _is_proper_name(name: str) -> bool:
+    """Whether every word is capitalized, which filters out highlights like "River cruises" """
+    return all(word[0].isupper() for word in name.split()) and name.lower() not in AMBIGUOUS_NAMES
+
+
+def build_gazetteer(countries: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+    """Map lowercase surface forms to (country, kind) for the given countries"""
+    gazetteer: Dict[str, Tuple[str, str]] = {}
+
+    def add(surface: str, country: str, kind: str) -> None:
+        gazetteer.setdefault(surface.lower(), (country, kind))
+
+    for country in countries:
+        add(country, country, "country")
+        for demonym in DEMONYMS.get(country, []):
+            add(demonym, country, "demonym")
+
+        data = CULTURAL_DATA.get(country, {})
+        capital = data.get('basic_info', {}).get('capital')
+        if capital:
+            add(capital, country, "capital")
+        for location in data.get('best_locations', []):
+            for name in _place_names(location['name']):
+                add(name, country, "location")
+            for highlight in location.get('highlights', []):
+                if _is_proper_name(highlight):
+                    add(highlight, country, "location")
+    return gazetteer
+
+
+class EntityRecognizer:
+    """Aho-Corasick automaton over a gazetteer of lowercase surface forms"""
+
+    def __init__(self, gazetteer: Dict[str, Tuple[str, str]]):
+        self.entities: List[Tuple[str, str, str]] = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+
+        for surface, (country, kind) in gazetteer.items():
+            node = 0
+            for char in surface:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append(len(self.entities))
+            self.entities.append((surface, country, kind))
+
+        # Breadth-first pass to link each node to its longest proper suffix in the trie
+        pending = deque(self.goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self.goto[node].items():
+                pending.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text: str) -> List[Entity]:
+        """Find whole-word gazetteer entries in text, preferring the longest leftmost matches"""
+        text = text.lower()
+        matches = []
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for entity_id in self.output[node]:
+                surface, country, kind = self.entities[entity_id]
+                start, end = position + 1 - len(surface), position + 1
+                # Only accept matches that start and end on word boundaries
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    matches.append(Entity(surface, country, kind, start, end))
+
+        matches.sort(key=lambda match: (match.start, match.start - match.end))
+        entities = []
+        covered = 0
+        for match in matches:
+            if match.start >= covered:
+                entities.append(match)
+                covered = match.end
+        return entities
+
+    def countries(self, text: str) -> List[str]:
+        """Countries referred to in text, in order of first mention"""
+        return list(dict.fromkeys(entity.country for entity in self.find(text)))
@@ -0,0 +1,178 @@
+"""
+Facet Index for CultureBot
+Per-country and per-category bitsets over the fact list, for combined filters and facet counts
+"""
+
+import re
+from bisect import insort
+from typing import Dict, List, Any, Iterable, Mapping, Optional, Tuple
+
+from knowledge_store import KnowledgeStore, next_version
+
+# Bit positions set in each byte value, for turning a bitset back into ids
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+NONZERO_BYTE_PATTERN = re.compile(rb"[^\x00]")
+
+
+def _to_bitset(ids: Iterable[int]) -> int:
+    """Build a bitset with the given positions set"""
+    bitmap = bytearray()
+    for position in ids:
+        index = position >> 3
+        if index >= len(bitmap):
+            bitmap.extend(bytes(index + 1 - len(bitmap)))
+        bitmap[index] |= 1 << (position & 7)
+    return int.from_bytes(bitmap, "little")
+
+
+def _to_ids(bits: int) -> List[int]:
+    """Positions set in a bitset, in increasing order"""
+    ids = []
+    # Let the regex engine skip the empty stretches of a sparse bitset
+    for match in NONZERO_BYTE_PATTERN.finditer(bits.to_bytes((bits.bit_length() + 7) // 8, "little")):
+        base = match.start() << 3
+        ids.extend(base + bit for bit in _BYTE_BITS[match.group()[0]])
+    return ids
+
+
+class Facet:
+    """Values of one fact field: a bitset and a count per lowercase value, plus the sorted display values"""
+
+    def __init__(self):
+        self.names: Dict[str, str] = {}
+        self.bits: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+        # Display spellings in sorted order, replaced rather than mutated so readers can hold on to it
+        self.values: Tuple[str, ...] = ()
+
+    def key(self, value: str) -> str:
+        """Lowercase key for a value, remembering the first spelling seen for display"""
+        key = value.lower()
+        self.names.setdefault(key, value)
+        return key
+
+    def load(self, ids_by_key: Dict[str, List[int]]) -> None:
+        """Set every value's fact ids at once; setting bits one at a time copies the whole integer each time"""
+        self.bits = {key: _to_bitset(ids) for key, ids in ids_by_key.items()}
+        self.counts = {key: len(ids) for key, ids in ids_by_key.items()}
+        self.values = tuple(sorted(self.names[key] for key in ids_by_key))
+
+    def add(self, value: str, fact_id: int) -> None:
+        key = self.key(value)
+        self.bits[key] = self.bits.get(key, 0) | 1 << fact_id
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.counts[key] == 1:
+            values = list(self.values)
+            insort(values, self.names[key])
+            self.values = tuple(values)
+
+    def remove(self, value: str, fact_id: int) -> None:
+        key = value.lower()
+        self.bits[key] &= ~(1 << fact_id)
+        self.counts[key] -= 1
+        if not self.counts[key]:
+            name = self.names.pop(key)
+            del self.bits[key], self.counts[key]
+            self.values = tuple(existing for existing in self.values if existing != name)
+
+    def get(self, value: str) -> int:
+        """Bitset of the facts with a value, matched case-insensitively"""
+        return self.bits.get(value.lower(), 0)
+
+    def counts_within(self, bits: int) -> Dict[str, int]:
+        """Count each value's facts inside a bitset, keyed by display spelling"""
+        return {self.names[key]: (value_bits & bits).bit_count() for key, value_bits in self.bits.items()}
+
+
+class FacetIndex:
+    """Country and category facets over fact ids, kept current as facts are added and removed"""
+
+    def __init__(self, facts: Iterable[Mapping[str, Any]] = ()):
+        self.size = 0
+        # Replaced on every change so callers can tell when cached facet data is stale; unique across
+        # indexes, so per-session state kept for one index is never mistaken for another's
+        self.version = next_version()
+        self.countries = Facet()
+        self.categories = Facet()
+
+        country_ids: Dict[str, List[int]] = {}
+        category_ids: Dict[str, List[int]] = {}
+        for fact_id, fact in enumerate(facts):
+            country_ids.setdefault(self.countries.key(fact['country']), []).append(fact_id)
+            category_ids.setdefault(self.categories.key(fact['category']), []).append(fact_id)
+            self.size += 1
+
+        self.all_bits = (1 << self.size) - 1
+        self.countries.load(country_ids)
+        self.categories.load(category_ids)
+
+    @classmethod
+    def from_store(cls, store: KnowledgeStore) -> "FacetIndex":
+        """Build the facets over a store's fact records from its string id columns
+
+        Facts are grouped by the interned country and category ids, and each distinct value is
+        read from the string table once, so no record payload is decoded.
+        """
+        index = cls()
+        fact_records = store.by_kind["fact"]
+        for facet, column in ((index.countries, store.country_ids), (index.categories, store.category_ids)):
+            ids_by_string: Dict[int, List[int]] = {}
+            for fact_id, record_id in enumerate(fact_records):
+                ids_by_string.setdefault(column[record_id], []).append(fact_id)
+            # Strings spelled differently may share a key; taking them in order of first use
+            # keeps the display spelling of the earliest fact
+            ids_by_key: Dict[str, List[int]] = {}
+            for string_id, ids in sorted(ids_by_string.items(), key=lambda item: item[1][0]):
+                ids_by_key.setdefault(facet.key(store.strings[string_id]), []).extend(ids)
+            facet.load(ids_by_key)
+        index.size = len(fact_records)
+        index.all_bits = (1 << index.size) - 1
+        return index
+
+    def add(self, fact: Mapping[str, Any]) -> int:
+        """Add the next fact and return its id"""
+        fact_id = self.size
+        self.countries.add(fact['country'], fact_id)
+        self.categories.add(fact['category'], fact_id)
+        self.all_bits |= 1 << fact_id
+        self.size += 1
+        self.version = next_version()
+        return fact_id
+
+    def remove(self, fact_id: int, fact: Mapping[str, Any]) -> None:
+        """Take a fact out of every facet; its id is not reused"""
+        if not self.all_bits >> fact_id & 1:
+            raise KeyError(fact_id)
+        self.countries.remove(fact['country'], fact_id)
+        self.categories.remove(fact['category'], fact_id)
+        self.all_bits &= ~(1 << fact_id)
+        self.version = next_version()
+
+    def _bits(self, country: Optional[str], category: Optional[str]) -> int:
+        bits = self.all_bits
+        if country is not None:
+            bits &= self.countries.get(country)
+        if category is not None:
+            bits &= self.categories.get(category)
+        return bits
+
+    def filter(self, country: Optional[str] = None, category: Optional[str] = None) -> List[int]:
+        """Get fact ids matching every given filter (case-insensitive), in order"""
+        return _to_ids(self._bits(country, category))
+
+    def count(self, country: Optional[str] = None, category: Optional[str] = None) -> int:
+        """Count facts matching every given filter"""
+        return self._bits(country, category).bit_count()
+
+    def facet_counts(self, country: Optional[str] = None,
+                     category: Optional[str] = None) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Get (country counts, category counts) under the current filters
+
+        Each facet is counted with the other facet's filter applied but not its own, so the
+        counts show what choosing a different value would return.
+        """
+        if country is None and category is None:
+            return ({self.countries.names[key]: count for key, count in self.countries.counts.items()},
+                    {self.categories.names[key]: count for key, count in self.categories.counts.items()})
+        return (self.countries.counts_within(self._bits(None, category)),
+                self.categories.counts_within(self._bits(country, None)))
@@ -0,0 +1,77 @@
+"""
+Fact Cards for CultureBot
+Escaped fact card HTML, rendered once per fact and joined into cached pages
+"""
+
+import html
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Mapping, Optional, Sequence, Tuple
+
+FACTS_PER_PAGE = 25
+MAX_CACHED_PAGES = 256
+
+
+def render_fact_card(fact: Mapping[str, Any], compact: bool = False) -> str:
+    """HTML for one fact card; compact cards (the sidebar's) leave out the source"""
+    country = html.escape(fact['country'])
+    text = html.escape(fact['fact'])
+    category = html.escape(fact['category'])
+    if compact:
+        return (f'<div class="fact-card"><h4>{country}</h4><p>{text}</p>'
+                f'<small>Category: {category}</small></div>')
+    return (f'<div class="fact-card"><h3>{country}</h3><p>{text}</p>'
+            f'<div style="display: flex; justify-content: space-between; margin-top: 1rem;">'
+            f'<small><strong>Category:</strong> {category}</small>'
+            f'<small><strong>Source:</strong> {html.escape(fact["source"])}</small>'
+            f'</div></div>')
+
+
+def page_count(fact_count: int) -> int:
+    """Number of pages needed for `fact_count` facts"""
+    return max(1, -(-fact_count // FACTS_PER_PAGE))
+
+
+class FactCardCache:
+    """Rendered cards and joined pages, valid for one version of the facts"""
+
+    def __init__(self, max_pages: int = MAX_CACHED_PAGES):
+        self.max_pages = max_pages
+        self.version: Optional[int] = None
+        self.cards: Dict[Tuple[str, str, bool], str] = {}
+        self.pages: "OrderedDict[Tuple[Hashable, int], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: int) -> None:
+        if version != self.version:
+            self.cards = {}
+            self.pages = OrderedDict()
+            self.version = version
+
+    def card(self, fact: Mapping[str, Any], version: int, compact: bool = False) -> str:
+        """Get a fact's card HTML, rendering it only the first time"""
+        with self._lock:
+            self._check_version(version)
+            key = (fact['country'], fact['fact'], compact)
+            card = self.cards.get(key)
+            if card is None:
+                card = render_fact_card(fact, compact)
+                self.cards[key] = card
+            return card
+
+    def page(self, key: Hashable, facts: Sequence[Mapping[str, Any]], page: int, version: int) -> str:
+        """Get one page of `facts` as a single HTML payload, cached under the filter `key`"""
+        with self._lock:
+            self._check_version(version)
+            payload = self.pages.get((key, page))
+            if payload is not None:
+                self.pages.move_to_end((key, page))
+                return payload
+        start = (page - 1) * FACTS_PER_PAGE
+        payload = "\n".join(self.card(fact, version) for fact in facts[start:start + FACTS_PER_PAGE])
+        with self._lock:
+            if version == self.version:
+                self.pages[(key, page)] = payload
+                if len(self.pages) > self.max_pages:
+                    self.pages.popitem(last=False)
+        return payload
@@ -0,0 +1,246 @@
+"""
+Fact Sampler for CultureBot
+Constant-time random facts: weighted draws from alias tables and per-session no-repeat cursors
+"""
+
+import random
+import threading
+from array import array
+from collections import OrderedDict
+from typing import List, Any, Optional, Sequence, Tuple
+
+from facet_index import FacetIndex
+
+# Filter combinations whose id arrays and alias tables are kept, shared by all sessions
+MAX_CACHED_FILTERS = 64
+
+# Walks a single session keeps a cursor for: one per filter combination, or per filter and
+# country when countries are balanced
+MAX_SESSION_WALKS = 256
+
+# Passes over at most this many facts are shuffled outright; a generator over a small power of
+# two can only produce a few of the possible orders
+MAX_SHUFFLED_PASS = 256
+
+# Alias-table draws a balanced cursor makes before rebuilding its table over the countries
+# it has not finished
+MAX_COUNTRY_REDRAWS = 4
+
+FilterKey = Tuple[Optional[str], Optional[str]]
+
+
+def _filter_key(country: Optional[str], category: Optional[str]) -> FilterKey:
+    return (country.lower() if country is not None else None, category.lower() if category is not None else None)
+
+
+class AliasTable:
+    """Vose's alias method: O(n) to build, O(1) per weighted draw"""
+
+    def __init__(self, weights: Sequence[float]):
+        count = len(weights)
+        total = float(sum(weights))
+        self.probability = array('d', [0.0]) * count
+        self.alias = array('I', [0]) * count
+
+        scaled = [weight * count / total for weight in weights] if total > 0 else [1.0] * count
+        small = [index for index, value in enumerate(scaled) if value < 1.0]
+        large = [index for index, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Whatever is left over is a full column up to rounding error
+        for index in small + large:
+            self.probability[index] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.probability)
+
+    def sample(self, rng: random.Random) -> int:
+        """Draw an index with probability proportional to its weight"""
+        column = rng.randrange(len(self.probability))
+        return column if rng.random() < self.probability[column] else self.alias[column]
+
+
+class FactSampler:
+    """Id arrays per filter combination and alias tables over countries, rebuilt when the facets change
+
+    With balanced countries, a draw first picks a country with matching facts, weighted by the
+    share of its facts that match, then a fact within it. Each country then comes up about as
+    often as any other however many facts it has, as if every fact were weighted by one over its
+    country's count.
+    """
+
+    def __init__(self, facets: FacetIndex, balance_countries: bool = False):
+        self.facets = facets
+        self.balance_countries = balance_countries
+        self.rng = random.Random()
+        self._version = facets.version
+        self._ids: "OrderedDict[FilterKey, array]" = OrderedDict()
+        self._tables: "OrderedDict[Optional[str], Tuple[List[str], List[float], AliasTable]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self) -> None:
+        if self.facets.version != self._version:
+            self._ids.clear()
+            self._tables.clear()
+            self._version = self.facets.version
+
+    def ids(self, country: Optional[str] = None, category: Optional[str] = None) -> array:
+        """Fact ids matching the filters, built once per filter combination and facet version"""
+        key = _filter_key(country, category)
+        with self._lock:
+            self._check_version()
+            ids = self._ids.get(key)
+            if ids is None:
+                ids = array('I', self.facets.filter(*key))
+                self._ids[key] = ids
+                if len(self._ids) > MAX_CACHED_FILTERS:
+                    self._ids.popitem(last=False)
+            else:
+                self._ids.move_to_end(key)
+            return ids
+
+    def country_table(self, category: Optional[str] = None) -> Tuple[List[str], List[float], AliasTable]:
+        """Countries with facts in the category, their weights and an alias table over them"""
+        key = category.lower() if category is not None else None
+        with self._lock:
+            self._check_version()
+            entry = self._tables.get(key)
+            if entry is None:
+                countries = self.facets.countries
+                category_bits = self.facets.categories.get(key) if key is not None else self.facets.all_bits
+                matching = [(country, (bits & category_bits).bit_count() / countries.counts[country])
+                            for country, bits in countries.bits.items() if bits & category_bits]
+                weights = [weight for _, weight in matching]
+                entry = ([country for country, _ in matching], weights, AliasTable(weights))
+                self._tables[key] = entry
+                if len(self._tables) > MAX_CACHED_FILTERS:
+                    self._tables.popitem(last=False)
+            else:
+                self._tables.move_to_end(key)
+            return entry
+
+    def choose_country(self, category: Optional[str] = None, rng: Optional[random.Random] = None) -> Optional[str]:
+        """Draw a country with facts in the category, weighted by the share of its facts there"""
+        countries, _, table = self.country_table(category)
+        return countries[table.sample(rng or self.rng)] if countries else None
+
+    def sample(self, country: Optional[str] = None, category: Optional[str] = None) -> Optional[int]:
+        """Draw a matching fact id, balancing countries if asked to, or None if nothing matches"""
+        if self.balance_countries and country is None:
+            country = self.choose_country(category)
+            if country is None:
+                return None
+        ids = self.ids(country, category)
+        if not ids:
+            return None
+        return ids[self.rng.randrange(len(ids))]
+
+
+class SampleCursor:
+    """One session's walk through each filter's facts in shuffled order, never repeating within a pass
+
+    Small passes are shuffled outright. Larger ones follow a full-period linear congruential
+    generator over the next power of two, skipping values past the end, so a cursor needs
+    bounded memory however many facts match. With a sampler that balances countries, each
+    draw picks a country the way the sampler does among those whose pass still has unseen
+    facts, and every country starts its next pass together once all are done, so no fact
+    repeats until every matching one has been seen.
+    """
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random()
+        # Filter -> [facet version, modulus, multiplier, increment, state, ids left in this pass,
+        # shuffled positions or None]
+        self._walks: "OrderedDict[FilterKey, List[Any]]" = OrderedDict()
+        # Category -> (facet version, countries whose pass has unseen facts, alias table over them)
+        self._unfinished: "OrderedDict[Optional[str], Tuple[int, List[str], AliasTable]]" = OrderedDict()
+
+    def _new_pass(self, version: int, count: int) -> List[Any]:
+        if count <= MAX_SHUFFLED_PASS:
+            return [version, 0, 0, 0, 0, count, array('I', self.rng.sample(range(count), count))]
+        modulus = 1 << (count - 1).bit_length()
+        # Full period modulo a power of two needs an odd increment and a multiplier of 1 mod 4
+        multiplier = 4 * self.rng.randrange(modulus // 4) + 1
+        increment = 2 * self.rng.randrange(modulus // 2) + 1
+        return [version, modulus, multiplier, increment, self.rng.randrange(modulus), count, None]
+
+    def _has_unseen(self, version: int, key: FilterKey) -> bool:
+        walk = self._walks.get(key)
+        return walk is None or walk[0] != version or walk[5] > 0
+
+    def _draw_unfinished(self, version: int, countries: List[str], table: AliasTable,
+                         category: Optional[str]) -> Optional[str]:
+        for _ in range(MAX_COUNTRY_REDRAWS):
+            country = countries[table.sample(self.rng)]
+            if self._has_unseen(version, _filter_key(country, category)):
+                return country
+        return None
+
+    def _choose_country(self, sampler: FactSampler, category: Optional[str]) -> Optional[str]:
+        """Draw a balanced country whose pass has unseen facts, starting a new round if none has"""
+        countries, weights, table = sampler.country_table(category)
+        if not countries:
+            return None
+        version = sampler.facets.version
+        country = self._draw_unfinished(version, countries, table, category)
+        if country is not None:
+            return country
+
+        # Most countries are done: draw from a table over the rest, rebuilt as they finish
+        key = category.lower() if category is not None else None
+        unfinished = self._unfinished.get(key)
+        if unfinished is not None and unfinished[0] == version:
+            country = self._draw_unfinished(version, unfinished[1], unfinished[2], category)
+            if country is not None:
+                return country
+        remaining = [(country, weight) for country, weight in zip(countries, weights)
+                     if self._has_unseen(version, _filter_key(country, category))]
+        if remaining:
+            unfinished = (version, [country for country, _ in remaining],
+                          AliasTable([weight for _, weight in remaining]))
+            self._unfinished[key] = unfinished
+            if len(self._unfinished) > MAX_SESSION_WALKS:
+                self._unfinished.popitem(last=False)
+            return unfinished[1][unfinished[2].sample(self.rng)]
+
+        # Every country's pass is done, so all of them start the next one together
+        self._unfinished.pop(key, None)
+        for country in countries:
+            self._walks.pop(_filter_key(country, category), None)
+        return countries[table.sample(self.rng)]
+
+    def next(self, sampler: FactSampler, country: Optional[str] = None,
+             category: Optional[str] = None) -> Optional[int]:
+        """Get the next unseen matching fact id, starting a fresh pass once all have been seen"""
+        if sampler.balance_countries and country is None:
+            country = self._choose_country(sampler, category)
+            if country is None:
+                return None
+        ids = sampler.ids(country, category)
+        if not ids:
+            return None
+
+        key = _filter_key(country, category)
+        walk = self._walks.get(key)
+        if walk is None or walk[0] != sampler.facets.version or walk[5] == 0:
+            walk = self._new_pass(sampler.facets.version, len(ids))
+            self._walks[key] = walk
+            if len(self._walks) > MAX_SESSION_WALKS:
+                self._walks.popitem(last=False)
+        else:
+            self._walks.move_to_end(key)
+
+        _, modulus, multiplier, increment, state, left, order = walk
+        walk[5] -= 1
+        if order is not None:
+            return ids[order[left - 1]]
+        while True:
+            state = (multiplier * state + increment) % modulus
+            if state < len(ids):
+                break
+        walk[4] = state
+        return ids[state]
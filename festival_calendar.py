@@ -0,0 +1,148 @@
+"""
+Festival Calendar for CultureBot
+Parses festival season strings once into day-of-year intervals for season, month and date queries
+"""
+
+import re
+import calendar
+from datetime import date
+from typing import Dict, List, Any, Iterable, Mapping, Optional, Sequence, Tuple
+
+SEASONS = ("spring", "summer", "autumn", "winter")
+
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+
+# Reference non-leap year used to turn month/day pairs into day-of-year numbers
+REFERENCE_YEAR = 2001
+
+# Day ranges implied by "Early", "Mid" and "Late" month qualifiers
+QUALIFIER_DAYS = {"early": (1, 10), "mid": (11, 20), "late": (21, None)}
+
+SEASON_PATTERN = re.compile(r"^\s*(?P<label>[^()]*?)\s*(?:\((?P<dates>[^)]*)\))?\s*$")
+DATE_PATTERN = re.compile(r"^(?:(?P<qualifier>early|mid|late)\s+)?(?P<month>[a-z]+)?\s*(?P<day>\d{1,2})?$")
+
+
+def _day_of_year(month: int, day: int) -> int:
+    """Day-of-year number of a month/day in the reference year"""
+    return date(REFERENCE_YEAR, month, day).timetuple().tm_yday
+
+
+def _month_length(month: int) -> int:
+    return calendar.monthrange(REFERENCE_YEAR, month)[1]
+
+
+def _parse_endpoint(text: str, default_month: Optional[int]) -> Optional[Tuple[int, int, int]]:
+    """Parse "Late April", "July 7" or a bare day into (month, first day, last day)"""
+    match = DATE_PATTERN.match(text.strip().lower())
+    if not match:
+        return None
+    name = match.group('month')
+    month = MONTHS.get(name) if name else default_month
+    if month is None:
+        return None
+
+    if match.group('day'):
+        day = min(int(match.group('day')), _month_length(month))
+        return month, day, day
+    if match.group('qualifier'):
+        first, last = QUALIFIER_DAYS[match.group('qualifier')]
+        return month, first, last or _month_length(month)
+    return month, 1, _month_length(month)
+
+
+def parse_season(text: str) -> Tuple[Tuple[str, ...], Optional[Tuple[int, int]]]:
+    """Parse a festival season string into its season names and day-of-year interval
+
+    "Spring (Late April-Early May)" becomes (("spring",), (111, 130)). The interval
+    wraps past the end of the year when its start is after its end, and is None when
+    the string has no usable dates, as with "Variable (based on lunar calendar)".
+    """
+    match = SEASON_PATTERN.match(text)
+    label = match.group('label') if match else text
+    dates = match.group('dates') if match else None
+
+    seasons = tuple(part for part in re.split(r"[/\s]+", label.lower()) if part in SEASONS)
+    if dates is None and label.lower() in MONTHS:
+        dates = label
+
+    interval = None
+    if dates:
+        parts = dates.split("-")
+        start = _parse_endpoint(parts[0], None)
+        end = _parse_endpoint(parts[-1], start[0] if start else None) if start else None
+        if start and end:
+            interval = (_day_of_year(start[0], start[1]), _day_of_year(end[0], end[2]))
+    return seasons, interval
+
+
+def _date_to_day(value: date) -> int:
+    """Day-of-year of a real date, folding 29 February onto the 28th"""
+    return _day_of_year(value.month, min(value.day, _month_length(value.month)))
+
+
+def _overlaps(interval: Tuple[int, int], start: int, end: int) -> bool:
+    """Whether a possibly wrapping interval overlaps the non-wrapping range start..end"""
+    first, last = interval
+    if first <= last:
+        return first <= end and start <= last
+    return start <= last or end >= first
+
+
+class FestivalCalendar:
+    """Season and month buckets of festival record ids with their parsed intervals"""
+
+    def __init__(self, festivals: Iterable[Tuple[int, Mapping[str, Any]]]):
+        self.records: Dict[int, Mapping[str, Any]] = {}
+        self.intervals: Dict[int, Tuple[int, int]] = {}
+        self.by_season: Dict[str, List[int]] = {season: [] for season in SEASONS}
+        self.by_month: Dict[int, List[int]] = {month: [] for month in range(1, 13)}
+        self.undated: List[int] = []
+
+        for record_id, festival in festivals:
+            self.records[record_id] = festival
+            seasons, interval = parse_season(festival['season'])
+            for season in seasons:
+                self.by_season[season].append(record_id)
+            if interval is None:
+                self.undated.append(record_id)
+                continue
+            self.intervals[record_id] = interval
+            for month in range(1, 13):
+                month_range = (_day_of_year(month, 1), _day_of_year(month, _month_length(month)))
+                if _overlaps(interval, *month_range):
+                    self.by_month[month].append(record_id)
+
+    def _records(self, record_ids: Iterable[int]) -> Tuple[Mapping[str, Any], ...]:
+        return tuple(self.records[record_id] for record_id in sorted(set(record_ids)))
+
+    def festivals_by_season(self, season: str) -> Sequence[Mapping[str, Any]]:
+        """Get festivals held in a season, such as "Summer" """
+        return self._records(self.by_season.get(season.strip().lower(), []))
+
+    def festivals_by_month(self, month: int) -> Sequence[Mapping[str, Any]]:
+        """Get festivals whose dates fall at least partly in a month (1-12)"""
+        return self._records(self.by_month.get(month, []))
+
+    def festivals_between(self, start: date, end: date) -> Sequence[Mapping[str, Any]]:
+        """Get festivals whose dates overlap the range start..end, such as a trip"""
+        if end < start:
+            raise ValueError("end date must not be before start date")
+        if (end - start).days >= 365:
+            return self._records(self.intervals)
+
+        first, last = _date_to_day(start), _date_to_day(end)
+        if first <= last:
+            ranges = [(first, last)]
+        else:
+            # The range crosses New Year, so check both halves
+            ranges = [(first, _day_of_year(12, 31)), (1, last)]
+
+        # Only festivals bucketed under one of the covered months can overlap
+        month_count = (end.year - start.year) * 12 + end.month - start.month
+        months = {(start.month - 1 + offset) % 12 + 1 for offset in range(min(month_count, 11) + 1)}
+        candidates = {record_id for month in months for record_id in self.by_month[month]}
+
+        return self._records(
+            record_id for record_id in candidates
+            if any(_overlaps(self.intervals[record_id], *day_range) for day_range in ranges)
+        )
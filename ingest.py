@@ -0,0 +1,278 @@
+"""
+Bulk Fact Ingestion for CultureBot
+Streams JSONL/CSV fact dumps through validation, normalization and deduplication into a snapshot
+
+Each input record uses the CulturalDatabase fact schema: country, fact, category and an
+optional source. Records are read one at a time and handed to a SnapshotBuilder, which
+spills their text and index segments to disk, so memory per fact is a few dozen bytes of
+ids plus its deduplication signature, however large the input files are.
+
+Usage: python ingest.py facts.jsonl more_facts.csv -o culturebot.snap [--no-base]
+       python ingest.py --check-minhash
+"""
+
+import argparse
+import csv
+import json
+import random
+import re
+import resource
+import sys
+import time
+from array import array
+from typing import Dict, List, Any, Iterable, Iterator, Mapping, Optional, Set
+
+import numpy as np
+
+from cultural_data import CULTURAL_DATA
+from knowledge_store import KnowledgeStore
+from search_index import tokenize
+from snapshot import DEFAULT_SNAPSHOT_PATH, SnapshotBuilder
+
+REQUIRED_FIELDS = ("country", "fact", "category")
+DEFAULT_SOURCE = "Imported Cultural Data"
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Near-duplicate detection: facts are compared as sets of word shingles, through MinHash
+# signatures split into LSH bands. Facts in the same country whose signatures agree on at
+# least NEAR_DUPLICATE_SIMILARITY of their values (an estimate of shingle Jaccard
+# similarity) are treated as the same fact.
+SHINGLE_SIZE = 2
+MINHASH_BANDS = 8
+MINHASH_ROWS = 4
+NEAR_DUPLICATE_SIMILARITY = 0.75
+# Each signature slot hashes shingles with its own (a * h + b) mod MINHASH_PRIME; a Mersenne
+# prime below 2**32 keeps the products within 64 bits and the minima within 32
+MINHASH_PRIME = (1 << 31) - 1
+BUCKET_TABLE_SIZE = 1024
+
+
+class IngestStats:
+    """Counters collected while a run streams through its inputs"""
+
+    def __init__(self):
+        self.read = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.ingested = 0
+        self.started = time.perf_counter()
+
+    def report(self) -> Dict[str, Any]:
+        """Summarize the run, including throughput and peak resident memory"""
+        elapsed = time.perf_counter() - self.started
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            # Linux reports kilobytes, macOS reports bytes
+            peak_rss *= 1024
+        return {
+            "read": self.read,
+            "invalid": self.invalid,
+            "duplicates": self.duplicates,
+            "ingested": self.ingested,
+            "seconds": round(elapsed, 3),
+            "records_per_second": round(self.read / elapsed) if elapsed else 0,
+            "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+        }
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream raw records from a .jsonl or .csv file; unparseable lines come through as None"""
+    with open(path, encoding="utf-8", newline="") as input_file:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(input_file)
+        else:
+            for line in input_file:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Passed on so normalize_records counts it as invalid
+                    yield None
+
+
+def normalize_records(records: Iterable[Any], stats: IngestStats) -> Iterator[Dict[str, str]]:
+    """Validate records and normalize their whitespace, casing and source"""
+    for record in records:
+        stats.read += 1
+        if not isinstance(record, dict) or any(
+            not isinstance(record.get(field), str) or not record[field].strip() for field in REQUIRED_FIELDS
+        ):
+            stats.invalid += 1
+            continue
+
+        source = record.get("source")
+        yield {
+            "country": WHITESPACE_PATTERN.sub(" ", record["country"]).strip(),
+            "fact": WHITESPACE_PATTERN.sub(" ", record["fact"]).strip(),
+            "category": record["category"].strip().lower(),
+            "source": source.strip() if isinstance(source, str) and source.strip() else DEFAULT_SOURCE,
+        }
+
+
+def shingle_hashes(text: str) -> Set[int]:
+    """Hashes of a text's SHINGLE_SIZE-word shingles, or of all its words if it is shorter"""
+    words = tokenize(text)
+    return set(map(hash, zip(*(words[offset:] for offset in range(SHINGLE_SIZE))))) or {hash(tuple(words))}
+
+
+class NearDuplicateFilter:
+    """MinHash signatures of the facts seen so far, with LSH band buckets to find similar ones
+
+    Each remembered fact costs a 32-bit value per signature slot and one bucket table entry
+    per band, whatever its length. Shingle hashes use Python's per-process string hashing,
+    so a filter is only meaningful within one run.
+    """
+
+    def __init__(self, seed: int = 0):
+        rng = random.Random(seed)
+        slots = MINHASH_BANDS * MINHASH_ROWS
+        self.multipliers = np.array([rng.randrange(1, MINHASH_PRIME) for _ in range(slots)], dtype=np.uint64)
+        self.offsets = np.array([rng.randrange(MINHASH_PRIME) for _ in range(slots)], dtype=np.uint64)
+        self.signatures = array('I')
+        # Open-addressed bucket table: band hash -> first fact number, -1 marks a free slot
+        self.bucket_keys = array('q', [0]) * BUCKET_TABLE_SIZE
+        self.bucket_owners = array('i', [-1]) * BUCKET_TABLE_SIZE
+        self.bucket_count = 0
+
+    def signature(self, fact: Mapping[str, str]) -> List[int]:
+        """MinHash of the fact's word shingles, ignoring case, punctuation and spacing"""
+        shingles = shingle_hashes(fact["fact"])
+        hashes = np.fromiter((shingle % MINHASH_PRIME for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        return ((hashes[:, None] * self.multipliers + self.offsets) % MINHASH_PRIME).min(axis=0).tolist()
+
+    def similarity(self, signature: List[int], fact_number: int) -> float:
+        """Estimated shingle similarity between a signature and a remembered fact"""
+        start = fact_number * len(self.multipliers)
+        return sum(a == b for a, b in zip(signature, self.signatures[start:start + len(self.multipliers)])) / len(self.multipliers)
+
+    def _slot(self, bucket: int) -> int:
+        """Table slot holding a bucket, or the free slot where it would go"""
+        mask = len(self.bucket_owners) - 1
+        slot = bucket & mask
+        while self.bucket_owners[slot] >= 0 and self.bucket_keys[slot] != bucket:
+            slot = (slot + 1) & mask
+        return slot
+
+    def _add_bucket(self, bucket: int, fact_number: int):
+        """Point a bucket at a fact unless an earlier fact already owns it"""
+        slot = self._slot(bucket)
+        if self.bucket_owners[slot] >= 0:
+            return
+        self.bucket_keys[slot] = bucket
+        self.bucket_owners[slot] = fact_number
+        self.bucket_count += 1
+
+        # Keep the table at most half full so probe runs stay short
+        if self.bucket_count * 2 > len(self.bucket_owners):
+            keys, owners = self.bucket_keys, self.bucket_owners
+            self.bucket_keys = array('q', [0]) * (len(keys) * 2)
+            self.bucket_owners = array('i', [-1]) * (len(owners) * 2)
+            for key, owner in zip(keys, owners):
+                if owner >= 0:
+                    slot = self._slot(key)
+                    self.bucket_keys[slot] = key
+                    self.bucket_owners[slot] = owner
+
+    def seen(self, fact: Mapping[str, str]) -> bool:
+        """Whether a near-identical fact in the same country was seen; remembers the fact if not"""
+        signature = self.signature(fact)
+        country = fact["country"].lower()
+        bands = [hash((country, band, tuple(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS])))
+                 for band in range(MINHASH_BANDS)]
+        for bucket in bands:
+            other = self.bucket_owners[self._slot(bucket)]
+            if other >= 0 and self.similarity(signature, other) >= NEAR_DUPLICATE_SIMILARITY:
+                return True
+
+        fact_number = len(self.signatures) // len(self.multipliers)
+        self.signatures.extend(signature)
+        for bucket in bands:
+            self._add_bucket(bucket, fact_number)
+        return False
+
+
+def deduplicate(facts: Iterable[Dict[str, str]], stats: IngestStats,
+                seen: Optional[NearDuplicateFilter] = None) -> Iterator[Dict[str, str]]:
+    """Drop facts near-identical to one already seen in the same country"""
+    seen = NearDuplicateFilter() if seen is None else seen
+    for fact in facts:
+        if seen.seen(fact):
+            stats.duplicates += 1
+            continue
+        yield fact
+
+
+def check_similarity_estimates(trials: int = 2000, seed: int = 0) -> Dict[str, float]:
+    """Compare signature similarity with the true shingle Jaccard similarity on random fact pairs
+
+    Each pair is a random 20-word fact and a copy with a random number of words replaced, so
+    the true similarities cover the whole range. With 32 signature slots the mean absolute
+    error should stay near 0.05 and the mean error near zero.
+    """
+    rng = random.Random(seed)
+    near_duplicates = NearDuplicateFilter(seed)
+    vocabulary = [f"word{number}" for number in range(2000)]
+    errors = []
+    for _ in range(trials):
+        words = [rng.choice(vocabulary) for _ in range(20)]
+        changed = list(words)
+        for position in rng.sample(range(len(words)), rng.randrange(len(words))):
+            changed[position] = rng.choice(vocabulary)
+        first, second = " ".join(words), " ".join(changed)
+        first_shingles, second_shingles = shingle_hashes(first), shingle_hashes(second)
+        jaccard = len(first_shingles & second_shingles) / len(first_shingles | second_shingles)
+        signatures = near_duplicates.signature({"fact": first}), near_duplicates.signature({"fact": second})
+        estimate = sum(a == b for a, b in zip(*signatures)) / len(signatures[0])
+        errors.append(estimate - jaccard)
+    return {
+        "trials": trials,
+        "mean_error": round(sum(errors) / trials, 3),
+        "mean_absolute_error": round(sum(map(abs, errors)) / trials, 3),
+        "max_absolute_error": round(max(map(abs, errors)), 3),
+    }
+
+
+def ingest(paths: List[str], output_path: str = DEFAULT_SNAPSHOT_PATH, include_base: bool = True,
+           spill_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Ingest fact files into a snapshot and return the run report"""
+    stats = IngestStats()
+    builder = SnapshotBuilder(spill_dir=spill_dir)
+    seen = NearDuplicateFilter()
+
+    # The base data comes first, and its facts count towards deduplication
+    if include_base:
+        base = KnowledgeStore(CULTURAL_DATA)
+        builder.add_store(base)
+        for fact in base.get_records("fact"):
+            seen.seen(fact)
+
+    records = (record for path in paths for record in read_records(path))
+    for fact in deduplicate(normalize_records(records, stats), stats, seen):
+        builder.add_record("fact", fact["country"], fact["category"], fact["fact"], fact["source"], fact)
+        stats.ingested += 1
+
+    builder.write(output_path)
+    return stats.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest cultural fact dumps into a CultureBot snapshot")
+    parser.add_argument("inputs", nargs="*", help="JSONL or CSV files with country, fact, category and source")
+    parser.add_argument("-o", "--output", default=DEFAULT_SNAPSHOT_PATH, help="snapshot file to write")
+    parser.add_argument("--no-base", action="store_true", help="leave out the built-in CULTURAL_DATA")
+    parser.add_argument("--check-minhash", action="store_true",
+                        help="report how closely signature similarity tracks true Jaccard similarity, then exit")
+    args = parser.parse_args()
+
+    if args.check_minhash:
+        for name, value in check_similarity_estimates().items():
+            print(f"  {name}: {value}")
+        sys.exit(0)
+    if not args.inputs:
+        parser.error("at least one input file is required")
+
+    report = ingest(args.inputs, args.output, include_base=not args.no_base)
+    print(f"Wrote {args.output}")
+    for name, value in report.items():
+        print(f"  {name}: {value}")
@@ -0,0 +1,81 @@
+"""
+Intent Classifier for CultureBot
+Maps a question to the topic it asks about and the knowledge store sections that answer it
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from search_index import tokenize
+
+
+class Intent(NamedTuple):
+    """A question topic and the (record kind, category) sections holding its answers
+
+    A category of None takes every record of that kind.
+    """
+    name: str
+    sections: Tuple[Tuple[str, Optional[str]], ...]
+
+
+# Intents in priority order; the earlier one wins when two match equally often
+INTENTS = [
+    Intent("greeting", (("fact", "greeting"),)),
+    Intent("business", (("fact", "business"),)),
+    Intent("food", (("fact", "food"), ("etiquette", None))),
+    Intent("etiquette", (("fact", "etiquette"), ("etiquette", None))),
+    Intent("language", (("fact", "language"), ("language", None))),
+    Intent("beliefs", (("fact", "beliefs"), ("fact", "symbolism"))),
+    Intent("family", (("fact", "family"),)),
+    Intent("expression", (("fact", "expression"), ("fact", "communication"))),
+    Intent("festivals", (("festival", None),)),
+    Intent("locations", (("location", None),)),
+]
+
+# Words that signal each intent; plurals ending in "s" are matched through their singular
+INTENT_LEXICON: Dict[str, List[str]] = {
+    "greeting": ["greeting", "greet", "hello", "hi", "bow", "bowing", "handshake", "hug", "kiss", "wai",
+                 "namaste", "welcome"],
+    "business": ["business", "businesses", "meeting", "work", "workplace", "office", "colleague", "negotiation",
+                 "professional", "punctuality", "punctual", "client", "card"],
+    "food": ["food", "dining", "dine", "eat", "eating", "meal", "dish", "cuisine", "restaurant", "drink",
+             "drinking", "coffee", "tea", "wine", "breakfast", "lunch", "dinner", "chopstick", "tip", "tipping"],
+    "etiquette": ["etiquette", "manner", "custom", "polite", "rude", "taboo", "avoid", "respect", "gift",
+                  "shoe", "gesture"],
+    "language": ["language", "speak", "spoken", "word", "phrase", "dialect", "writing", "alphabet",
+                 "translate", "say"],
+    "beliefs": ["belief", "beliefs", "superstition", "superstitious", "lucky", "unlucky", "luck", "number",
+                "religion", "religious", "spiritual", "symbol", "symbolism", "sacred"],
+    "family": ["family", "families", "parent", "child", "children", "elder", "grandparent", "marriage",
+               "wedding", "relative"],
+    "expression": ["expression", "express", "emotion", "smile", "smiling", "communication", "communicate",
+                   "direct", "indirect", "body", "eye", "contact"],
+    "festivals": ["festival", "festivities", "celebration", "celebrate", "holiday", "carnival", "parade",
+                  "feast"],
+    "locations": ["location", "place", "visit", "visiting", "travel", "destination", "landmark", "sight",
+                  "sightseeing", "city", "cities", "attraction", "trip", "tourist"],
+}
+
+
+class IntentClassifier:
+    """Scores a question against the intent lexicon with one dictionary lookup per word"""
+
+    def __init__(self, intents: List[Intent] = INTENTS, lexicon: Dict[str, List[str]] = INTENT_LEXICON):
+        self.intents = intents
+        # Compile the lexicon into a word -> intent position table
+        self.words: Dict[str, int] = {}
+        for position, intent in enumerate(intents):
+            for word in lexicon.get(intent.name, []):
+                self.words.setdefault(word, position)
+
+    def classify(self, message: str) -> Optional[Intent]:
+        """Get the intent the message matches most often, or None when no intent word appears"""
+        counts = [0] * len(self.intents)
+        for token in tokenize(message):
+            position = self.words.get(token)
+            if position is None and token.endswith("s"):
+                position = self.words.get(token[:-1])
+            if position is not None:
+                counts[position] += 1
+
+        best = max(range(len(counts)), key=lambda position: (counts[position], -position))
+        return self.intents[best] if counts[best] else None
@@ -0,0 +1,309 @@
+"""
+Knowledge Store for CultureBot
+Loads CULTURAL_DATA once into flat columnar records with per-field indexes
+"""
+
+import itertools
+import os
+import threading
+from array import array
+from collections.abc import Mapping
+from typing import Callable, Dict, List, Any, Iterator, Optional, Sequence, Tuple
+
+from cultural_data import CULTURAL_DATA
+from entity_recognizer import EntityRecognizer, build_gazetteer
+from festival_calendar import FestivalCalendar
+from search_index import InvertedIndex
+
+# Record kinds flattened out of each country entry
+RECORD_KINDS = ("fact", "festival", "location", "language", "etiquette")
+
+# Maximum number of cached query results kept per store
+QUERY_CACHE_SIZE = 1024
+
+# Environment variable naming a compiled snapshot to serve instead of CULTURAL_DATA
+SNAPSHOT_ENV_VAR = "CULTUREBOT_SNAPSHOT"
+
+
+def _intersect(left: List[int], right: List[int]) -> List[int]:
+    """Intersect two sorted id lists"""
+    results = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] == right[j]:
+            results.append(left[i])
+            i += 1
+            j += 1
+        elif left[i] < right[j]:
+            i += 1
+        else:
+            j += 1
+    return results
+
+
+class RecordView(Mapping):
+    """Read-only view of a source record with its country attached, without copying it"""
+
+    __slots__ = ('_payload', '_country')
+
+    def __init__(self, payload: Dict[str, Any], country: str):
+        self._payload = payload
+        self._country = country
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'country':
+            return self._country
+        return self._payload[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._payload
+        if 'country' not in self._payload:
+            yield 'country'
+
+    def __len__(self) -> int:
+        return len(self._payload) + ('country' not in self._payload)
+
+    def __repr__(self) -> str:
+        return f"RecordView({dict(self)!r})"
+
+
+class KnowledgeStore:
+    """Flattened, indexed view of every section of the cultural data
+
+    Each record has a kind, a country and a category. The category column holds the
+    fact category for facts, the season for festivals and the type for locations.
+    Strings are interned once in a shared table and the columns store their ids.
+    """
+
+    def __init__(self, data: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+
+        self.kind_ids = array('B')
+        self.country_ids = array('I')
+        self.category_ids = array('I')
+        self.text_ids = array('I')
+        self.source_ids = array('I')
+        self.records: List[RecordView] = []
+        self._query_cache: Dict[Tuple[Any, ...], Tuple[RecordView, ...]] = {}
+
+        self.by_kind: Dict[str, List[int]] = {kind: [] for kind in RECORD_KINDS}
+        self.by_country: Dict[str, List[int]] = {}
+        self.by_category: Dict[str, List[int]] = {}
+
+        # Prebuilt search index over the fact records, set when loaded from a snapshot
+        # or built alongside the store during ingestion
+        self.fact_index: Optional[InvertedIndex] = None
+        self._calendar: Optional[FestivalCalendar] = None
+        self._entities: Optional[EntityRecognizer] = None
+        # Stores mapped from a snapshot share read-only pages and cannot grow
+        self.read_only = False
+
+        for country, country_data in (data or {}).items():
+            self._load_country(country, country_data)
+
+    @property
+    def calendar(self) -> FestivalCalendar:
+        """Festival calendar, parsed from the festival season strings on first use"""
+        if self._calendar is None:
+            self._calendar = FestivalCalendar(
+                (record_id, self.records[record_id]) for record_id in self.by_kind["festival"]
+            )
+        return self._calendar
+
+    @property
+    def entities(self) -> EntityRecognizer:
+        """Recognizer for the countries, demonyms and places of the stored countries, compiled on first use"""
+        if self._entities is None:
+            countries = [self.records[ids[0]]['country'] for ids in self.by_country.values() if len(ids)]
+            self._entities = EntityRecognizer(build_gazetteer(countries))
+        return self._entities
+
+    def _intern(self, value: str) -> int:
+        """Return the string table id for a value, adding it if needed"""
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(value)
+            self._string_ids[value] = string_id
+        return string_id
+
+    def _add(self, kind: str, country: str, category: str, text: str, source: str,
+             payload: Dict[str, Any]) -> None:
+        """Append one record to the columns and the per-field indexes"""
+        record_id = len(self.records)
+        self.kind_ids.append(RECORD_KINDS.index(kind))
+        self.country_ids.append(self._intern(country))
+        self.category_ids.append(self._intern(category))
+        self.text_ids.append(self._intern(text))
+        self.source_ids.append(self._intern(source))
+
+        self.records.append(RecordView(payload, country))
+
+        self.by_kind[kind].append(record_id)
+        self.by_country.setdefault(country.lower(), []).append(record_id)
+        self.by_category.setdefault(category.lower(), []).append(record_id)
+
+    def _load_country(self, country: str, data: Dict[str, Any]) -> None:
+        """Flatten every section of a country entry into records"""
+        for fact in data.get('cultural_facts', []):
+            self._add("fact", country, fact['category'], fact['fact'], fact['source'], fact)
+
+        for festival in data.get('festivals', []):
+            self._add("festival", country, festival['season'], festival['description'],
+                      festival['name'], festival)
+
+        for location in data.get('best_locations', []):
+            self._add("location", country, location['type'], location['description'],
+                      location['name'], location)
+
+        for text in data.get('languages', {}).get('facts', []):
+            self._add("language", country, "language", text, "Languages",
+                      {"fact": text, "category": "language", "source": "Languages"})
+
+        for text in data.get('food_culture', {}).get('dining_etiquette', []):
+            self._add("etiquette", country, "dining", text, "Dining Etiquette",
+                      {"fact": text, "category": "dining", "source": "Dining Etiquette"})
+
+    def add_fact(self, fact: Dict[str, Any]) -> int:
+        """Add a cultural fact record, index it for search and return its position among the fact records"""
+        if self.read_only:
+            raise TypeError("Cannot add facts to a read-only snapshot store")
+        new_country = fact['country'].lower() not in self.by_country
+        self._add("fact", fact['country'], fact['category'], fact['fact'], fact['source'], fact)
+        if new_country:
+            # Recompiled on next use so the new country is recognized in questions
+            self._entities = None
+        fact_id = len(self.by_kind["fact"]) - 1
+        if self.fact_index is not None:
+            self.fact_index.add(fact_id, fact)
+        self._query_cache.clear()
+        return fact_id
+
+    def kind_of(self, record_id: int) -> str:
+        """Get the kind of a record"""
+        return RECORD_KINDS[self.kind_ids[record_id]]
+
+    def select(self, kind: str, country: Optional[str] = None, category: Optional[str] = None,
+               category_contains: Optional[str] = None) -> List[int]:
+        """Get sorted record ids of a kind, optionally filtered by country and category
+
+        `category` is an exact, case-insensitive match; `category_contains` matches
+        any category value containing the given text.
+        """
+        ids = self.by_kind[kind]
+        if country is not None:
+            ids = _intersect(ids, self.by_country.get(country.lower(), []))
+        if category is not None:
+            ids = _intersect(ids, self.by_category.get(category.lower(), []))
+        if category_contains is not None:
+            needle = category_contains.lower()
+            matching = sorted(record_id for value, value_ids in self.by_category.items()
+                              if needle in value for record_id in value_ids)
+            ids = _intersect(ids, matching)
+        return ids
+
+    def get_records(self, kind: str, **filters: Optional[str]) -> Sequence[RecordView]:
+        """Get the records of a kind matching the given filters, cached per query"""
+        key = (kind,) + tuple(sorted((name, value.lower()) for name, value in filters.items()
+                                     if value is not None))
+        records = self._query_cache.get(key)
+        if records is None:
+            records = tuple(self.records[record_id] for record_id in self.select(kind, **filters))
+            if len(self._query_cache) >= QUERY_CACHE_SIZE:
+                # Drop the oldest cached query
+                self._query_cache.pop(next(iter(self._query_cache)))
+            self._query_cache[key] = records
+        return records
+
+
+# Versions handed out for datasets and the structures built on them, unique for the process
+# so caches keyed on a version can never mistake a swapped-in dataset for the old one
+_versions = itertools.count(1)
+
+
+def next_version() -> int:
+    """Get a process-wide unique version number for a new or changed dataset"""
+    return next(_versions)
+
+
+def load_default_store() -> KnowledgeStore:
+    """Load the store named by CULTUREBOT_SNAPSHOT, or build one from CULTURAL_DATA"""
+    snapshot_path = os.environ.get(SNAPSHOT_ENV_VAR)
+    if snapshot_path:
+        from snapshot import load_snapshot
+        return load_snapshot(snapshot_path)
+    return KnowledgeStore(CULTURAL_DATA)
+
+
+class StoreRegistry:
+    """Process-wide current knowledge store and the objects built from it, swappable at runtime
+
+    Factories registered by name (the app's CulturalDatabase, for one) are built once per
+    store. swap() builds them all for the new store first and then publishes store and
+    objects together with a single reference assignment, so concurrent readers see either
+    the old dataset or the new one in full, never a mix. Readers that hold on to an object
+    keep a consistent view until they ask the registry again.
+    """
+
+    def __init__(self, loader: Callable[[], KnowledgeStore] = load_default_store):
+        self._loader = loader
+        self._factories: Dict[str, Callable[[KnowledgeStore], Any]] = {}
+        self._state: Optional[Tuple[KnowledgeStore, Dict[str, Any]]] = None
+        self._lock = threading.RLock()
+
+    def _current_state(self) -> Tuple[KnowledgeStore, Dict[str, Any]]:
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    self._state = (self._loader(), {})
+                state = self._state
+        return state
+
+    def current(self) -> KnowledgeStore:
+        """Get the live knowledge store, loading it on first use"""
+        return self._current_state()[0]
+
+    def register(self, name: str, factory: Callable[[KnowledgeStore], Any]) -> None:
+        """Register how to build a named object from a store; the latest registration wins"""
+        with self._lock:
+            self._factories[name] = factory
+
+    def get(self, name: str) -> Any:
+        """Get the named object built from the live store, building it on first use"""
+        store, built = self._current_state()
+        value = built.get(name)
+        if value is None:
+            with self._lock:
+                # Another thread may have built it, or swapped the store, in the meantime
+                store, built = self._current_state()
+                value = built.get(name)
+                if value is None:
+                    value = self._factories[name](store)
+                    built[name] = value
+        return value
+
+    def swap(self, store: KnowledgeStore) -> None:
+        """Publish a new store once every registered object has been built from it"""
+        with self._lock:
+            built = {name: factory(store) for name, factory in self._factories.items()}
+            self._state = (store, built)
+
+    def reload(self) -> KnowledgeStore:
+        """Load the store again (e.g. after a new snapshot was written) and swap it in"""
+        store = self._loader()
+        self.swap(store)
+        return store
+
+
+registry = StoreRegistry()
+
+
+def get_store() -> KnowledgeStore:
+    """Get the process-wide knowledge store, loading it on first use
+
+    When the CULTUREBOT_SNAPSHOT environment variable names a compiled snapshot, the
+    store is opened from it lazily instead of being built from CULTURAL_DATA.
+    """
+    return registry.current()
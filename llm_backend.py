@@ -0,0 +1,178 @@
+"""
+LLM Backend for CultureBot
+OpenAI-compatible generation with pooled connections, timeouts, concurrency limits and request coalescing
+
+CultureAI hands the backend a question and its retrieved facts. When the backend is not
+configured, times out or fails, CultureAI falls back to its rule-based templates.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Any, Iterator, Mapping, Optional, Sequence, Tuple
+
+from context_builder import DEFAULT_TOKEN_BUDGET, ContextBuilder, format_snippet
+
+SYSTEM_PROMPT = (
+    "You are a cultural guide for travelers and learners. Given a country or region, provide its "
+    "cultural etiquette, traditional greetings, popular festivals, and one interesting fun fact. "
+    "Be friendly, short, and educational. Base your answer on the cultural facts provided."
+)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+# Environment variables read by create_backend_from_env
+BASE_URL_ENV_VAR = "CULTUREBOT_LLM_BASE_URL"
+MODEL_ENV_VAR = "CULTUREBOT_LLM_MODEL"
+API_KEY_ENV_VAR = "OPENAI_API_KEY"
+CONTEXT_TOKENS_ENV_VAR = "CULTUREBOT_CONTEXT_TOKENS"
+
+
+def build_messages(user_message: str, context_lines: Sequence[str]) -> List[Dict[str, str]]:
+    """Build chat messages carrying the selected context lines"""
+    context = "\n".join(f"- {line}" for line in context_lines)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Cultural facts:\n{context}\n\nQuestion: {user_message}"},
+    ]
+
+
+class RequestCoalescer:
+    """Sends requests through a bounded worker pool, sharing one call among identical requests
+
+    A request is dispatched as soon as it arrives. One equal to a request that is still in
+    flight waits for that call's result instead of making its own. The pool size caps
+    upstream concurrency.
+    """
+
+    def __init__(self, handler, max_concurrency: int = 8):
+        self.handler = handler
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._in_flight: Dict[Any, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, request: Any) -> Future:
+        """Dispatch a hashable request, or join the equal one already in flight"""
+        with self._lock:
+            future = self._in_flight.get(request)
+            if future is not None:
+                return future
+            future = self._pool.submit(self.handler, request)
+            self._in_flight[request] = future
+        # Added outside the lock: a call that already finished runs the callback right away
+        future.add_done_callback(partial(self._finished, request))
+        return future
+
+    def _finished(self, request: Any, future: Future) -> None:
+        with self._lock:
+            if self._in_flight.get(request) is future:
+                del self._in_flight[request]
+
+
+class OpenAIBackend:
+    """Chat completions from any OpenAI-compatible server"""
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: str = DEFAULT_MODEL, timeout: float = 10.0, max_concurrency: int = 8,
+                 max_connections: int = 20, max_tokens: int = 300,
+                 context_builder: Optional[ContextBuilder] = None):
+        # Imported here so the rule-based path works without the client libraries installed
+        import httpx
+        import openai
+
+        self.model = model
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        # Without a context builder every retrieved fact goes into the prompt as-is
+        self.context_builder = context_builder
+        # Completions that failed and left CultureAI to fall back to its templates
+        self.failures = 0
+        self._failures_lock = threading.Lock()
+        # One pooled HTTP client is shared by every session in the process
+        self.client = openai.OpenAI(
+            base_url=base_url,
+            api_key=api_key or "not-needed",
+            timeout=timeout,
+            max_retries=1,
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                timeout=timeout,
+            ),
+        )
+        self.coalescer = RequestCoalescer(self._complete, max_concurrency=max_concurrency)
+        # Streamed completions are not coalesced; they get a concurrency cap of their own
+        self._stream_slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _complete(self, messages: Tuple[Tuple[str, str], ...]) -> str:
+        completion = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": role, "content": content} for role, content in messages],
+            max_tokens=self.max_tokens,
+        )
+        return completion.choices[0].message.content or ""
+
+    def complete(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        """Run one chat completion, or return None if it fails or times out"""
+        request = tuple((message["role"], message["content"]) for message in messages)
+        try:
+            return self.coalescer.submit(request).result(timeout=self.timeout) or None
+        except Exception:
+            # Timeouts, client errors and malformed replies (such as no choices) all fall back
+            with self._failures_lock:
+                self.failures += 1
+            return None
+
+    def stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """Run one chat completion, yielding its text as the server writes it
+
+        Unlike complete, failures are raised, possibly after part of the text was yielded.
+        """
+        if not self._stream_slots.acquire(timeout=self.timeout):
+            raise TimeoutError("No free slot for a streamed completion")
+        try:
+            chunks = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=self.max_tokens,
+                stream=True,
+            )
+            for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            self._stream_slots.release()
+
+    def _messages(self, user_message: str, facts: Sequence[Mapping[str, Any]]) -> List[Dict[str, str]]:
+        """Chat messages asking the question over its retrieved facts"""
+        if self.context_builder is not None:
+            context_lines = self.context_builder.build(user_message, facts)
+        else:
+            context_lines = [format_snippet("fact", fact) for fact in facts]
+        return build_messages(user_message, context_lines)
+
+    def generate(self, user_message: str, facts: Sequence[Mapping[str, Any]]) -> Optional[str]:
+        """Write an answer to a question from its retrieved facts, or None on failure"""
+        return self.complete(self._messages(user_message, facts))
+
+    def generate_stream(self, user_message: str, facts: Sequence[Mapping[str, Any]]) -> Iterator[str]:
+        """Stream an answer to a question from its retrieved facts; failures are raised"""
+        return self.stream(self._messages(user_message, facts))
+
+
+def create_backend_from_env() -> Optional[OpenAIBackend]:
+    """Create an OpenAI-compatible backend if a base URL or API key is configured"""
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    base_url = os.environ.get(BASE_URL_ENV_VAR)
+    api_key = os.environ.get(API_KEY_ENV_VAR)
+    if not base_url and not api_key:
+        return None
+    token_budget = int(os.environ.get(CONTEXT_TOKENS_ENV_VAR, DEFAULT_TOKEN_BUDGET))
+    return OpenAIBackend(base_url=base_url, api_key=api_key,
+                         model=os.environ.get(MODEL_ENV_VAR, DEFAULT_MODEL),
+                         context_builder=ContextBuilder(token_budget=token_budget))
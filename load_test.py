@@ -0,0 +1,91 @@
+"""
+Load Test for CultureBot's LLM path
+Fires concurrent chat turns through CultureAI (caches, retrieval, context building and the
+OpenAI-compatible backend) and reports latency
+
+Without --url, a mock server is started in-process so the whole path can be measured offline.
+CultureAI lives in the Streamlit app module, so importing it also runs the page once in bare mode.
+
+Usage: python load_test.py [--requests 500] [--concurrency 32] [--latency 0.2] [--url URL]
+"""
+
+import argparse
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any
+
+from app import CultureAI
+from knowledge_store import get_store
+from llm_backend import OpenAIBackend
+from mock_llm_server import start_mock_server
+
+QUESTIONS = [
+    "Tell me about Japanese business etiquette",
+    "What are some Indian greeting customs?",
+    "How do Germans view punctuality?",
+    "What should I know about dining in France?",
+    "Explain Chinese lucky numbers",
+    "How do people greet each other in Thailand?",
+    "What gestures should I avoid in Brazil?",
+    "Is it rude to smile at strangers in Russia?",
+]
+
+# Asked about every country in the store, so most turns miss the response cache
+COUNTRY_QUESTIONS = [
+    "How do people greet each other in {country}?",
+    "What should I know about dining in {country}?",
+    "What are the business customs in {country}?",
+    "Which festivals are celebrated in {country}?",
+]
+
+
+def run_load_test(backend: OpenAIBackend, requests: int, concurrency: int,
+                  retrieval_mode: str = "ranked") -> Dict[str, Any]:
+    """Send `requests` chat turns with `concurrency` parallel users and summarize latencies"""
+    culture_ai = CultureAI(retrieval_mode=retrieval_mode, backend=backend)
+    countries = sorted({fact["country"] for fact in get_store().get_records("fact")})
+    pool = QUESTIONS + [question.format(country=country) for question in COUNTRY_QUESTIONS for country in countries]
+
+    def chat_turn(question: str) -> float:
+        started = time.perf_counter()
+        culture_ai.generate_response(question)
+        return time.perf_counter() - started
+
+    questions = [random.choice(pool) for _ in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as users:
+        latencies: List[float] = sorted(users.map(chat_turn, questions))
+    wall_time = time.perf_counter() - started
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    cache = culture_ai.response_cache.stats()
+    return {
+        "requests": requests,
+        "llm_failures": backend.failures,
+        "cache_hits": cache["hits"],
+        "throughput_per_second": round(requests / wall_time, 1),
+        "p50_ms": round(percentiles[49] * 1000, 1),
+        "p99_ms": round(percentiles[98] * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test CultureBot's LLM generation path")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32, help="number of simulated parallel users")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock server delay in seconds")
+    parser.add_argument("--url", help="OpenAI-compatible base URL to test instead of the mock server")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="backend upstream concurrency limit")
+    parser.add_argument("--mode", default="ranked", choices=["keyword", "ranked", "hybrid"], help="retrieval mode")
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        _, url = start_mock_server(latency=args.latency)
+    backend = OpenAIBackend(base_url=url, max_concurrency=args.max_concurrency)
+
+    for name, value in run_load_test(backend, args.requests, args.concurrency, args.mode).items():
+        print(f"{name}: {value}")
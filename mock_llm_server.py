@@ -0,0 +1,104 @@
+"""
+Mock LLM Server for CultureBot
+Local stand-in for an OpenAI-compatible chat completions endpoint, for offline load testing
+
+Usage: python mock_llm_server.py [--port 8001] [--latency 0.2] [--jitter 0.05]
+Then point CultureBot at it with CULTUREBOT_LLM_BASE_URL=http://127.0.0.1:8001/v1
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+
+class MockCompletionHandler(BaseHTTPRequestHandler):
+    """Answers chat completion requests with a canned reply after a simulated delay"""
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.2
+    jitter = 0.05
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        question = body.get("messages", [{}])[-1].get("content", "").rsplit("Question:", 1)[-1].strip()
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        content = f"(mock) Here is what I know about: {question}"
+        if body.get("stream"):
+            self._stream_reply(body, content)
+            return
+
+        reply = json.dumps({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def _stream_reply(self, body: dict, content: str) -> None:
+        """Send the reply word by word as server-sent completion chunks, then close the connection"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for word in re.findall(r"\S+\s*", content):
+            chunk = json.dumps({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": word}}],
+            })
+            self.wfile.write(f"data: {chunk}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.latency / 20)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, format: str, *args) -> None:
+        # Keep load tests quiet
+        pass
+
+
+def start_mock_server(port: int = 0, latency: float = 0.2, jitter: float = 0.05) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the mock server on a background thread and return it with its /v1 base URL"""
+    handler = type("ConfiguredHandler", (MockCompletionHandler,), {"latency": latency, "jitter": jitter})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible chat completions server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2, help="mean response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="standard deviation of the delay")
+    args = parser.parse_args()
+
+    server, url = start_mock_server(args.port, args.latency, args.jitter)
+    print(f"Mock LLM server listening at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,80 @@
+"""
+Response Cache for CultureBot
+Bounded LRU cache with TTL expiry for generated chat responses
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Fold case, punctuation and whitespace so equivalent questions share a cache key"""
+    return WHITESPACE_PATTERN.sub(" ", PUNCTUATION_PATTERN.sub(" ", query.lower())).strip()
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache tied to a data version
+
+    Entries are dropped when they are older than `ttl` seconds, when the cache is over
+    `max_size`, or all at once when a lookup arrives with a different data version.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version: Any = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: Any) -> None:
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key: str, version: Any) -> Optional[Dict[str, Any]]:
+        """Get a cached response, or None on a miss"""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, version: Any, response: Dict[str, Any]) -> None:
+        """Store a response, evicting the least recently used entry when full"""
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached response"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit, miss and eviction counters and the current size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,268 @@
+"""
+Search Index for CultureBot
+Tokenized inverted index used to look up cultural facts without scanning the whole list
+"""
+
+import re
+import math
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from functools import partial, reduce
+from itertools import chain, combinations, islice
+from operator import add, itemgetter
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Postings whose BM25 contributions are kept in the per-term impact cache, across all terms
+MAX_CACHED_IMPACTS = 500000
+
+# A subset's facts are read in impact order for at most this many scored facts, or this
+# factor times their number of postings, before the rest are scored together instead
+MAX_WALKED_FACTS = 64
+IMPACT_WALK_FACTOR = 4
+
+# Queries with more distinct terms than this are scored exhaustively instead of by term subsets
+MAX_PRUNED_TERMS = 8
+
+# Very common words that carry no ranking signal and have the longest postings
+STOPWORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "do", "for", "from", "how", "i",
+    "in", "is", "it", "me", "of", "on", "or", "s", "some", "tell", "that", "the",
+    "their", "to", "what", "when", "with", "about", "should", "know", "you",
+})
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word terms"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _take_unique(posting_lists: Iterable[List[int]], limit: int) -> List[int]:
+    """Merge sorted posting lists in id order, stopping once `limit` ids are collected"""
+    results: List[int] = []
+    last = -1
+    for fact_id in heapq.merge(*posting_lists):
+        if fact_id == last:
+            continue
+        results.append(fact_id)
+        last = fact_id
+        if len(results) >= limit:
+            break
+    return results
+
+
+def _push_top(top: List[Tuple[float, int]], k: int, score: float, fact_id: int) -> None:
+    """Keep the `k` best (score, fact id) pairs in a min-heap"""
+    if len(top) < k:
+        heapq.heappush(top, (score, fact_id))
+    elif score > top[0][0]:
+        heapq.heapreplace(top, (score, fact_id))
+
+
+class InvertedIndex:
+    """Term, country and category postings for a list of facts, keyed by fact position"""
+
+    def __init__(self):
+        self.postings: Dict[str, List[int]] = {}
+        self.term_freqs: Dict[str, array] = {}
+        self.doc_lengths = array('I')
+        self.total_length = 0
+        self.terms: List[str] = []
+        self._idf: Dict[str, float] = {}
+        # Per-term fact id -> BM25 contribution (highest first) and id set, for the most recently queried terms
+        self._impacts: "OrderedDict[str, Tuple[Dict[int, float], frozenset]]" = OrderedDict()
+        self._cached_impacts = 0
+        self._impacts_lock = threading.Lock()
+        self.country_map: Dict[str, List[int]] = {}
+        self.category_map: Dict[str, List[int]] = {}
+        # Indexes mapped from a snapshot share read-only pages and cannot grow
+        self.read_only = False
+
+    def add(self, fact_id: int, fact: Dict[str, Any]) -> None:
+        """Index a single fact; ids must be consecutive and start at 0"""
+        if self.read_only:
+            raise TypeError("Cannot add facts to a read-only snapshot index")
+        self.country_map.setdefault(fact['country'].lower(), []).append(fact_id)
+        self.category_map.setdefault(fact['category'].lower(), []).append(fact_id)
+
+        counts = Counter(tokenize(f"{fact['fact']} {fact['country']} {fact['category']}"))
+        for term, count in counts.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                self.postings[term] = [fact_id]
+                self.term_freqs[term] = array('H', [count])
+                insort(self.terms, term)
+            else:
+                posting.append(fact_id)
+                self.term_freqs[term].append(count)
+
+        length = sum(counts.values())
+        self.doc_lengths.append(length)
+        self.total_length += length
+        self._idf.clear()
+        with self._impacts_lock:
+            self._impacts.clear()
+            self._cached_impacts = 0
+
+    def idf(self, term: str) -> float:
+        """Inverse document frequency of a term, cached until the index changes"""
+        value = self._idf.get(term)
+        if value is None:
+            doc_freq = len(self.postings.get(term, ()))
+            doc_count = len(self.doc_lengths)
+            value = math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+            self._idf[term] = value
+        return value
+
+    def impacts(self, term: str) -> Tuple[Dict[int, float], frozenset]:
+        """A term's fact id -> BM25 contribution in order of decreasing contribution, and its fact ids as a set
+
+        Cached until the index changes, least recently used terms first out once the
+        cache holds more than MAX_CACHED_IMPACTS postings.
+        """
+        with self._impacts_lock:
+            cached = self._impacts.get(term)
+            if cached is not None:
+                self._impacts.move_to_end(term)
+                return cached
+
+        idf = self.idf(term)
+        avg_length = self.total_length / len(self.doc_lengths)
+        doc_lengths = self.doc_lengths
+        scored = [(idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[fact_id] / avg_length)),
+                   fact_id) for fact_id, tf in zip(self.postings[term], self.term_freqs[term])]
+        scored.sort(key=itemgetter(0), reverse=True)
+        impacts = {fact_id: score for score, fact_id in scored}
+        cached = (impacts, frozenset(impacts))
+
+        with self._impacts_lock:
+            if term not in self._impacts:
+                self._impacts[term] = cached
+                self._cached_impacts += len(impacts)
+            while self._cached_impacts > MAX_CACHED_IMPACTS and len(self._impacts) > 1:
+                _, (evicted, _) = self._impacts.popitem(last=False)
+                self._cached_impacts -= len(evicted)
+        return cached
+
+    def has_prefix(self, token: str) -> bool:
+        """Whether any indexed term starts with `token`"""
+        position = bisect_left(self.terms, token)
+        return position < len(self.terms) and self.terms[position].startswith(token)
+
+    def _prefix_postings(self, token: str) -> Iterator[List[int]]:
+        """Yield the posting list of every indexed term starting with `token`"""
+        position = bisect_left(self.terms, token)
+        while position < len(self.terms) and self.terms[position].startswith(token):
+            yield self.postings[self.terms[position]]
+            position += 1
+
+    def search(self, query: str, limit: int = 5, countries: Optional[List[str]] = None) -> List[int]:
+        """Return up to `limit` fact ids using country, then category, then keyword matching
+
+        `countries` are the countries already recognized in the query; without them the
+        query is scanned for country names as substrings.
+        """
+        query_lower = query.lower()
+
+        # Search by country
+        if countries is not None:
+            matches = [self.country_map[country.lower()] for country in countries if country.lower() in self.country_map]
+        else:
+            matches = [ids for country, ids in self.country_map.items() if country in query_lower]
+        if matches:
+            return _take_unique(matches, limit)
+
+        # Search by category
+        matches = [ids for category, ids in self.category_map.items() if category in query_lower]
+        if matches:
+            return _take_unique(matches, limit)
+
+        # Search by keywords in fact content
+        matches = [ids for token in set(tokenize(query_lower)) for ids in self._prefix_postings(token)]
+        return _take_unique(matches, limit)
+
+    def rank(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Return the top `k` (fact id, BM25 score) pairs for a query, best first
+
+        Facts are found through the subsets of query terms they contain, taken in order of
+        the highest score a fact with those terms could reach, and stopping once no subset
+        can beat the current k-th score. A subset's facts are read in impact order of its
+        strongest term, stopping as soon as the rest cannot beat the k-th score; when that
+        takes too long, the remaining facts sharing the subset's terms are scored together.
+        Facts with equal scores may come back in any order.
+        """
+        if not self.doc_lengths or k <= 0:
+            return []
+        terms = sorted(term for term in set(tokenize(query)) if term not in STOPWORDS and term in self.postings)
+        if len(terms) > MAX_PRUNED_TERMS:
+            return self._rank_exhaustive(terms, k)
+
+        impacts = {term: self.impacts(term) for term in terms}
+        bounds = {term: next(iter(impacts[term][0].values())) for term in terms}
+        subsets = sorted((subset for size in range(1, len(terms) + 1) for subset in combinations(terms, size)),
+                         key=lambda subset: sum(bounds[term] for term in subset), reverse=True)
+        # Fact ids containing every term of a subset, built up from the subset's prefixes
+        containing: Dict[Tuple[str, ...], frozenset] = {(term,): impacts[term][1] for term in terms}
+        top: List[Tuple[float, int]] = []
+        scored = set()
+
+        for subset in subsets:
+            bound = sum(bounds[term] for term in subset)
+            if len(top) == k and bound <= top[0][0]:
+                break
+            for size in range(2, len(subset) + 1):
+                if subset[:size] not in containing:
+                    containing[subset[:size]] = containing[subset[:size - 1]] & impacts[subset[size - 1]][1]
+            within = containing[subset]
+
+            # Facts with more of the query terms were scored by earlier subsets, so the rest
+            # here contain exactly these terms
+            term_impacts = [impacts[term][0] for term in subset]
+            pivot = max(subset, key=bounds.get)
+            rest = bound - bounds[pivot]
+            finished = False
+            if len(within) > MAX_WALKED_FACTS:
+                walked = 0
+                for fact_id, impact in islice(impacts[pivot][0].items(), len(within) * IMPACT_WALK_FACTOR):
+                    if len(top) == k and impact + rest <= top[0][0]:
+                        finished = True
+                        break
+                    if fact_id in within and fact_id not in scored:
+                        scored.add(fact_id)
+                        _push_top(top, k, sum(contributions[fact_id] for contributions in term_impacts), fact_id)
+                        walked += 1
+                        if walked == MAX_WALKED_FACTS:
+                            break
+            if not finished:
+                candidates = list(within - scored)
+                scored.update(candidates)
+                # Sum the contributions term by term rather than fact by fact
+                scores = reduce(partial(map, add), (map(contributions.__getitem__, candidates)
+                                                    for contributions in term_impacts))
+                top[:] = heapq.nlargest(k, chain(top, zip(scores, candidates)))
+                top.reverse()
+
+        return [(fact_id, fact_score) for fact_score, fact_id in sorted(top, reverse=True)]
+
+    def _rank_exhaustive(self, terms: List[str], k: int) -> List[Tuple[int, float]]:
+        """Term-at-a-time scoring of every fact that shares a term with the query"""
+        avg_length = self.total_length / len(self.doc_lengths)
+        doc_lengths = self.doc_lengths
+        scores: Dict[int, float] = {}
+
+        # Term-at-a-time scoring touches only facts that share a term with the query
+        for term in terms:
+            idf = self.idf(term)
+            for fact_id, tf in zip(self.postings[term], self.term_freqs[term]):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[fact_id] / avg_length)
+                scores[fact_id] = scores.get(fact_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
@@ -0,0 +1,252 @@
+"""
+Semantic Index for CultureBot
+CPU-only hashed embeddings of facts and festivals with exact and IVF cosine top-k search
+
+Texts are embedded by hashing word and character trigram features into a fixed number
+of dimensions, weighted by inverse document frequency and L2-normalized, so similar
+wordings ("greet", "greeting", "greetings") land close together without a model download.
+Small corpora are searched exactly with one matrix-vector product; large ones go through
+an inverted-file (IVF) index that only scores the clusters nearest to the query.
+
+Usage:
+    python semantic_index.py build [output.npz]
+    python semantic_index.py evaluate
+"""
+
+import os
+import sys
+import time
+import zlib
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+from knowledge_store import KnowledgeStore, get_store
+from search_index import InvertedIndex, STOPWORDS, tokenize
+
+EMBEDDING_DIM = 1024
+
+# Record kinds embedded into the index
+SEMANTIC_KINDS = ("fact", "festival")
+
+# Corpora at least this large use the IVF index instead of exact search
+IVF_THRESHOLD = 10000
+IVF_PROBES = 8
+KMEANS_ITERATIONS = 10
+
+DEFAULT_INDEX_PATH = "culturebot_vectors.npz"
+
+# Environment variable naming a prebuilt index to load instead of embedding at startup
+VECTORS_ENV_VAR = "CULTUREBOT_VECTORS"
+
+# Questions used by `evaluate`, including paraphrases the keyword path handles poorly
+EVALUATION_QUERIES = [
+    "Tell me about Japanese business etiquette",
+    "What are some Indian greeting customs?",
+    "How do Germans view punctuality?",
+    "What should I know about dining in France?",
+    "Explain Chinese lucky numbers",
+    "how do people say hello in Bangkok",
+    "is it ok to be late to a meeting in Berlin",
+    "which gestures are offensive in Brazil",
+    "festival of lights celebration",
+    "what do people drink in the morning in Italy",
+]
+
+
+def _features(text: str) -> List[str]:
+    """Word and character trigram features of a text"""
+    features = []
+    for word in tokenize(text):
+        if word in STOPWORDS:
+            continue
+        features.append(word)
+        padded = f"<{word}>"
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+
+def _hash_counts(text: str) -> Dict[int, float]:
+    """Signed feature-hashing counts of a text, keyed by dimension"""
+    counts: Dict[int, float] = {}
+    for feature in _features(text):
+        digest = zlib.crc32(feature.encode("utf-8"))
+        dimension = digest % EMBEDDING_DIM
+        sign = 1.0 if digest & 0x80000000 else -1.0
+        counts[dimension] = counts.get(dimension, 0.0) + sign
+    return counts
+
+
+def record_text(kind: str, record) -> str:
+    """Text embedded for a store record"""
+    if kind == "festival":
+        return f"{record['name']} {record['description']} {record.get('significance', '')}"
+    return record['fact']
+
+
+def store_fingerprint(store: KnowledgeStore) -> int:
+    """Checksum of the records an index over this store embeds, in id order"""
+    checksum = 0
+    for record_id in sorted(i for kind in SEMANTIC_KINDS for i in store.select(kind)):
+        kind = store.kind_of(record_id)
+        text = f"{record_id}\t{kind}\t{record_text(kind, store.records[record_id])}\n"
+        checksum = zlib.crc32(text.encode("utf-8"), checksum)
+    return checksum
+
+
+class SemanticIndex:
+    """Embedding matrix over store records with cosine top-k search"""
+
+    def __init__(self, record_ids: np.ndarray, vectors: np.ndarray, idf: np.ndarray,
+                 fingerprint: Optional[int] = None):
+        self.record_ids = record_ids
+        self.vectors = vectors
+        self.idf = idf
+        # store_fingerprint() of the store the vectors were built from
+        self.fingerprint = fingerprint
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        if len(record_ids) >= IVF_THRESHOLD:
+            self.build_ivf()
+
+    @classmethod
+    def from_store(cls, store: KnowledgeStore) -> "SemanticIndex":
+        """Embed every fact and festival in a knowledge store"""
+        record_ids = np.array(sorted(i for kind in SEMANTIC_KINDS for i in store.select(kind)), dtype=np.int64)
+        counts = np.zeros((len(record_ids), EMBEDDING_DIM), dtype=np.float32)
+        for row, record_id in enumerate(record_ids):
+            record_id = int(record_id)
+            for dimension, value in _hash_counts(record_text(store.kind_of(record_id), store.records[record_id])).items():
+                counts[row, dimension] = value
+
+        doc_freq = np.count_nonzero(counts, axis=0)
+        idf = np.log((1 + len(record_ids)) / (1 + doc_freq)).astype(np.float32) + 1.0
+        return cls(record_ids, _normalize(counts * idf), idf, store_fingerprint(store))
+
+    @classmethod
+    def load(cls, path: str) -> "SemanticIndex":
+        """Load an index saved with save()"""
+        with np.load(path) as data:
+            fingerprint = int(data["fingerprint"]) if "fingerprint" in data else None
+            return cls(data["record_ids"], data["vectors"], data["idf"], fingerprint)
+
+    def save(self, path: str) -> None:
+        extra = {} if self.fingerprint is None else {"fingerprint": np.int64(self.fingerprint)}
+        np.savez(path, record_ids=self.record_ids, vectors=self.vectors, idf=self.idf, **extra)
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a query into the index's vector space"""
+        vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+        for dimension, value in _hash_counts(text).items():
+            vector[dimension] = value
+        return _normalize(vector * self.idf)
+
+    def build_ivf(self, list_count: Optional[int] = None, seed: int = 0) -> None:
+        """Cluster the vectors with spherical k-means for approximate search"""
+        list_count = list_count or max(1, int(np.sqrt(len(self.vectors))))
+        rng = np.random.default_rng(seed)
+        centroids = self.vectors[rng.choice(len(self.vectors), list_count, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+            for cluster in range(list_count):
+                members = self.vectors[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = members.sum(axis=0)
+            centroids = _normalize(centroids)
+
+        assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignments == cluster) for cluster in range(list_count)]
+
+    def search(self, query: str, k: int = 5, exact: bool = False) -> List[Tuple[int, float]]:
+        """Return the top `k` (record id, cosine similarity) pairs, best first"""
+        query_vector = self.embed(query)
+        if not query_vector.any() or not len(self.vectors):
+            return []
+
+        if self.centroids is None or exact:
+            rows = None
+            scores = self.vectors @ query_vector
+        else:
+            nearest = np.argsort(self.centroids @ query_vector)[-IVF_PROBES:]
+            rows = np.concatenate([self.lists[cluster] for cluster in nearest])
+            scores = self.vectors[rows] @ query_vector
+
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        positions = top if rows is None else rows[top]
+        return [(int(self.record_ids[position]), float(score))
+                for position, score in zip(positions, scores[top]) if score > 0]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def load_semantic_index(store: KnowledgeStore) -> SemanticIndex:
+    """Load the prebuilt index named by CULTUREBOT_VECTORS, or embed the store now
+
+    A prebuilt index built from different records than the store holds (or saved without
+    a fingerprint) is ignored, since its record ids would point at the wrong records.
+    """
+    path = os.environ.get(VECTORS_ENV_VAR)
+    if path and os.path.exists(path):
+        index = SemanticIndex.load(path)
+        if index.fingerprint is not None and index.fingerprint == store_fingerprint(store):
+            return index
+    return SemanticIndex.from_store(store)
+
+
+def evaluate(index: SemanticIndex, store: KnowledgeStore, queries: Sequence[str], k: int = 5) -> Dict[str, Any]:
+    """Compare semantic results with the keyword path: latency and recall of keyword hits
+
+    When the IVF index is active, its recall against exact search is reported as well.
+    """
+    facts = store.select("fact")
+    keyword_index = InvertedIndex()
+    for fact_id, record_id in enumerate(facts):
+        keyword_index.add(fact_id, store.records[record_id])
+
+    recalled = expected = ivf_recalled = exact_total = 0
+    latencies = []
+    for query in queries:
+        keyword_hits = {facts[fact_id] for fact_id in keyword_index.search(query, limit=k)}
+        started = time.perf_counter()
+        semantic_hits = {record_id for record_id, _ in index.search(query, k)}
+        latencies.append(time.perf_counter() - started)
+        recalled += len(keyword_hits & semantic_hits)
+        expected += len(keyword_hits)
+        if index.centroids is not None:
+            exact_hits = {record_id for record_id, _ in index.search(query, k, exact=True)}
+            ivf_recalled += len(exact_hits & semantic_hits)
+            exact_total += len(exact_hits)
+
+    latencies.sort()
+    report = {
+        "queries": len(queries),
+        "records": len(index.record_ids),
+        "mean_latency_ms": round(1000 * sum(latencies) / len(latencies), 3),
+        "p99_latency_ms": round(1000 * latencies[int(0.99 * (len(latencies) - 1))], 3),
+        f"recall_at_{k}_vs_keyword": round(recalled / expected, 3) if expected else None,
+    }
+    if exact_total:
+        report[f"ivf_recall_at_{k}_vs_exact"] = round(ivf_recalled / exact_total, 3)
+    return report
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "build":
+        output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_PATH
+        SemanticIndex.from_store(get_store()).save(output_path)
+        print(f"Wrote {output_path}")
+    elif command == "evaluate":
+        store = get_store()
+        report = evaluate(SemanticIndex.from_store(store), store, EVALUATION_QUERIES * 20)
+        for name, value in report.items():
+            print(f"{name}: {value}")
+    else:
+        print(__doc__.strip().split("Usage:")[-1])
+        sys.exit(1)
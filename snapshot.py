@@ -0,0 +1,424 @@
+"""
+Compiled Snapshot for CultureBot
+Writes the knowledge store and fact search index into one binary file and maps it back lazily
+
+Layout: a fixed header, a section table of (name, offset, length) entries, then the
+sections themselves, each aligned to 8 bytes. Strings live in a single UTF-8 blob with an
+offset table; record columns and posting lists are flat arrays of string ids and record
+ids. Opening a snapshot only parses the header; everything else is read through memory
+views over the mapped file, so worker processes share the same pages.
+
+Snapshots are built record by record: strings, payloads and sections go to spill files
+as they are produced, and the fact index is built in segments that are merged at the end.
+
+Usage: python snapshot.py build [output_path]
+"""
+
+import bisect
+import heapq
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from typing import BinaryIO, Dict, List, Any, Iterator, Optional, Tuple
+
+from cultural_data import CULTURAL_DATA
+from knowledge_store import RECORD_KINDS, KnowledgeStore, RecordView
+from search_index import InvertedIndex
+
+MAGIC = b"CBSNAP\x00\x01"
+FORMAT_VERSION = 1
+DEFAULT_SNAPSHOT_PATH = "culturebot.snap"
+
+# Decoded strings kept per string table
+STRING_CACHE_SIZE = 65536
+
+HEADER = struct.Struct("<8sIIB7x")
+SECTION_ENTRY = struct.Struct("<32sQQ")
+BYTE_ORDERS = {"little": 0, "big": 1}
+
+# Facts indexed in memory before their postings are spilled as one sorted segment
+INDEX_SEGMENT_SIZE = 20000
+
+# Spilled segment entry: term byte length and posting count, followed by the term,
+# its fact ids and their term frequencies
+SEGMENT_ENTRY = struct.Struct("<II")
+
+
+class _SnapshotWriter:
+    """Collects sections and strings in spill files, then writes them out in one pass"""
+
+    def __init__(self, spill_dir: str):
+        self.spill_dir = spill_dir
+        self.sections: Dict[str, str] = {}
+        self.string_offsets = array('Q', [0])
+        self._string_ids: Dict[str, int] = {}
+        self._strings_file = self.section_file("strings.data")
+
+    def section_file(self, name: str) -> BinaryIO:
+        """Open the spill file a section is written to; it must be closed before write()"""
+        path = os.path.join(self.spill_dir, name)
+        self.sections[name] = path
+        return open(path, "wb")
+
+    def add_bytes(self, name: str, data: bytes) -> None:
+        with self.section_file(name) as section:
+            section.write(data)
+
+    def add_array(self, name: str, typecode: str, values) -> None:
+        self.add_bytes(name, array(typecode, values).tobytes())
+
+    def add_string(self, value: str) -> int:
+        """Append a string without looking for an earlier copy, for values that are nearly always unique"""
+        encoded = value.encode("utf-8")
+        self._strings_file.write(encoded)
+        self.string_offsets.append(self.string_offsets[-1] + len(encoded))
+        return len(self.string_offsets) - 2
+
+    def intern(self, value: str) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self.add_string(value)
+            self._string_ids[value] = string_id
+        return string_id
+
+    def add_posting_map(self, name: str, mapping: Mapping, typecode: str = 'I') -> List[str]:
+        """Write a key -> sorted ids map as sorted keys, offsets and values; return key order"""
+        keys = sorted(mapping)
+        offsets = array('I', [0])
+        with self.section_file(f"{name}.values") as values:
+            for key in keys:
+                ids = array(typecode, mapping[key])
+                values.write(ids.tobytes())
+                offsets.append(offsets[-1] + len(ids))
+        self.add_array(f"{name}.keys", 'I', (self.intern(key) for key in keys))
+        self.add_bytes(f"{name}.offsets", offsets.tobytes())
+        return keys
+
+    def write(self, path: str) -> None:
+        self._strings_file.close()
+        self.add_bytes("strings.offsets", self.string_offsets.tobytes())
+
+        table_end = HEADER.size + SECTION_ENTRY.size * len(self.sections)
+        position = (table_end + 7) & ~7
+        entries = []
+        for name, spill_path in self.sections.items():
+            length = os.path.getsize(spill_path)
+            entries.append((name, position, length))
+            position = (position + length + 7) & ~7
+
+        with open(path, "wb") as output:
+            output.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(entries), BYTE_ORDERS[sys.byteorder]))
+            for name, offset, length in entries:
+                output.write(SECTION_ENTRY.pack(name.encode("ascii"), offset, length))
+            for name, offset, length in entries:
+                output.write(b"\x00" * (offset - output.tell()))
+                with open(self.sections[name], "rb") as section:
+                    shutil.copyfileobj(section, output)
+
+
+def _read_segment(path: str) -> Iterator[Tuple[str, bytes, bytes]]:
+    """Yield (term, fact ids, term frequencies) from a spilled index segment, in term order"""
+    with open(path, "rb") as segment:
+        while True:
+            header = segment.read(SEGMENT_ENTRY.size)
+            if not header:
+                return
+            term_length, count = SEGMENT_ENTRY.unpack(header)
+            term = segment.read(term_length).decode("utf-8")
+            yield term, segment.read(4 * count), segment.read(2 * count)
+
+
+class SnapshotBuilder:
+    """Builds a snapshot one record at a time in bounded memory
+
+    Strings and payloads are appended to spill files as records arrive. The fact index is
+    built in segments of `segment_size` facts, each spilled sorted by term and merged into
+    the final posting lists by write(). Memory holds the current segment plus a few
+    fixed-width ids per record, however long the texts are.
+    """
+
+    def __init__(self, segment_size: int = INDEX_SEGMENT_SIZE, spill_dir: Optional[str] = None):
+        self.segment_size = segment_size
+        self._spill = tempfile.TemporaryDirectory(prefix="culturebot-snapshot-", dir=spill_dir)
+        self._writer = _SnapshotWriter(self._spill.name)
+
+        self.kind_ids = array('B')
+        self.columns = {column: array('I') for column in ("country", "category", "text", "source", "payload")}
+        self.by_kind: Dict[str, array] = {kind: array('I') for kind in RECORD_KINDS}
+        self.by_country: Dict[str, array] = {}
+        self.by_category: Dict[str, array] = {}
+
+        # Fact lengths and country/category postings cover every fact; term postings only the current segment
+        self.doc_lengths = array('I')
+        self.total_length = 0
+        self.country_map: Dict[str, array] = {}
+        self.category_map: Dict[str, array] = {}
+        self._segment = InvertedIndex()
+        self._segment_start = 0
+        self._segment_paths: List[str] = []
+
+    def add_record(self, kind: str, country: str, category: str, text: str, source: str,
+                   payload: Dict[str, Any]) -> int:
+        """Append one record, indexing it if it is a fact, and return its record id"""
+        writer = self._writer
+        record_id = len(self.kind_ids)
+        self.kind_ids.append(RECORD_KINDS.index(kind))
+        self.columns["country"].append(writer.intern(country))
+        self.columns["category"].append(writer.intern(category))
+        self.columns["text"].append(writer.add_string(text))
+        self.columns["source"].append(writer.intern(source))
+        self.columns["payload"].append(writer.add_string(json.dumps(payload, ensure_ascii=False)))
+
+        self.by_kind[kind].append(record_id)
+        self.by_country.setdefault(country.lower(), array('I')).append(record_id)
+        self.by_category.setdefault(category.lower(), array('I')).append(record_id)
+        if kind == "fact":
+            self._index_fact(RecordView(payload, country))
+        return record_id
+
+    def add_store(self, store: KnowledgeStore) -> None:
+        """Append every record of a knowledge store, in order"""
+        for record_id, record in enumerate(store.records):
+            self.add_record(store.kind_of(record_id), record['country'],
+                            store.strings[store.category_ids[record_id]], store.strings[store.text_ids[record_id]],
+                            store.strings[store.source_ids[record_id]], dict(record._payload))
+
+    def _index_fact(self, fact: RecordView) -> None:
+        # Fact ids in the index are positions within the fact records, as in CulturalDatabase
+        fact_id = len(self.doc_lengths)
+        self._segment.add(fact_id - self._segment_start, fact)
+        self.doc_lengths.append(self._segment.doc_lengths[-1])
+        self.total_length += self._segment.doc_lengths[-1]
+        self.country_map.setdefault(fact['country'].lower(), array('I')).append(fact_id)
+        self.category_map.setdefault(fact['category'].lower(), array('I')).append(fact_id)
+        if len(self._segment.doc_lengths) >= self.segment_size:
+            self._spill_segment()
+
+    def _spill_segment(self) -> None:
+        segment = self._segment
+        path = os.path.join(self._spill.name, f"segment-{len(self._segment_paths)}")
+        with open(path, "wb") as output:
+            for term in segment.terms:
+                encoded = term.encode("utf-8")
+                fact_ids = array('I', (self._segment_start + local_id for local_id in segment.postings[term]))
+                output.write(SEGMENT_ENTRY.pack(len(encoded), len(fact_ids)))
+                output.write(encoded)
+                output.write(fact_ids.tobytes())
+                output.write(segment.term_freqs[term].tobytes())
+        self._segment_paths.append(path)
+        self._segment = InvertedIndex()
+        self._segment_start = len(self.doc_lengths)
+
+    def _merge_segments(self) -> None:
+        """Write the term postings of every segment as one posting map, term by term"""
+        writer = self._writer
+        key_ids = array('I')
+        offsets = array('I', [0])
+        entries = heapq.merge(*(_read_segment(path) for path in self._segment_paths), key=itemgetter(0))
+        with writer.section_file("index.postings.values") as values, writer.section_file("index.term_freqs") as freqs:
+            # Segments cover increasing fact ids, so appending them in order keeps postings sorted
+            for term, parts in groupby(entries, key=itemgetter(0)):
+                count = 0
+                for _, fact_ids, term_freqs in parts:
+                    values.write(fact_ids)
+                    freqs.write(term_freqs)
+                    count += len(fact_ids) // 4
+                key_ids.append(writer.intern(term))
+                offsets.append(offsets[-1] + count)
+        writer.add_bytes("index.postings.keys", key_ids.tobytes())
+        writer.add_bytes("index.postings.offsets", offsets.tobytes())
+
+    def write(self, path: str) -> None:
+        """Merge the index segments, write the snapshot file and remove the spill files"""
+        try:
+            if len(self._segment.doc_lengths):
+                self._spill_segment()
+            writer = self._writer
+            writer.add_array("records.kind", 'B', self.kind_ids)
+            for column, string_ids in self.columns.items():
+                writer.add_array(f"records.{column}", 'I', string_ids)
+            writer.add_posting_map("by_kind", self.by_kind)
+            writer.add_posting_map("by_country", self.by_country)
+            writer.add_posting_map("by_category", self.by_category)
+
+            self._merge_segments()
+            writer.add_array("index.doc_lengths", 'I', self.doc_lengths)
+            writer.add_posting_map("index.country_map", self.country_map)
+            writer.add_posting_map("index.category_map", self.category_map)
+            writer.add_bytes("meta", json.dumps({"total_length": self.total_length}).encode("utf-8"))
+            writer.write(path)
+        finally:
+            self._spill.cleanup()
+
+
+def write_snapshot(store: KnowledgeStore, path: str) -> None:
+    """Compile a knowledge store and an index over its facts into a snapshot file"""
+    builder = SnapshotBuilder()
+    builder.add_store(store)
+    builder.write(path)
+
+
+class StringTable(Sequence):
+    """Strings decoded on demand from the mapped UTF-8 blob"""
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+        # Cached per table rather than on the class, so a swapped-out snapshot is freed with it
+        self._cached = lru_cache(maxsize=STRING_CACHE_SIZE)(self._decode)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, string_id: int) -> str:
+        return self._cached(string_id)
+
+    def _decode(self, string_id: int) -> str:
+        return bytes(self._data[self._offsets[string_id]:self._offsets[string_id + 1]]).decode("utf-8")
+
+
+class SortedKeys(Sequence):
+    """Sorted key strings of a posting map, usable with bisect"""
+
+    def __init__(self, key_ids: memoryview, strings: StringTable):
+        self._key_ids = key_ids
+        self._strings = strings
+
+    def __len__(self) -> int:
+        return len(self._key_ids)
+
+    def __getitem__(self, position: int) -> str:
+        return self._strings[self._key_ids[position]]
+
+
+class PostingMap(Mapping):
+    """Read-only key -> id list mapping whose values are slices of a mapped array"""
+
+    def __init__(self, keys: SortedKeys, offsets: memoryview, values: memoryview):
+        self.keys_sequence = keys
+        self._offsets = offsets
+        self._values = values
+
+    def __getitem__(self, key: str) -> memoryview:
+        position = bisect.bisect_left(self.keys_sequence, key)
+        if position == len(self.keys_sequence) or self.keys_sequence[position] != key:
+            raise KeyError(key)
+        return self._values[self._offsets[position]:self._offsets[position + 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys_sequence)
+
+    def __len__(self) -> int:
+        return len(self.keys_sequence)
+
+
+class SnapshotRecordView(RecordView):
+    """Record view whose payload is decoded from the snapshot on first access"""
+
+    __slots__ = ('_strings', '_payload_id')
+
+    def __init__(self, strings: StringTable, payload_id: int, country: str):
+        self._strings = strings
+        self._payload_id = payload_id
+        self._country = country
+
+    def __getattr__(self, name: str) -> Any:
+        # Only reached while the _payload slot is still unset
+        if name == '_payload':
+            self._payload = json.loads(self._strings[self._payload_id])
+            return self._payload
+        raise AttributeError(name)
+
+
+class SnapshotRecords(Sequence):
+    """Record views created on demand from the mapped columns"""
+
+    def __init__(self, strings: StringTable, country_ids: memoryview, payload_ids: memoryview):
+        self._strings = strings
+        self._country_ids = country_ids
+        self._payload_ids = payload_ids
+
+    def __len__(self) -> int:
+        return len(self._payload_ids)
+
+    def __getitem__(self, record_id: int) -> SnapshotRecordView:
+        return SnapshotRecordView(self._strings, self._payload_ids[record_id],
+                                  self._strings[self._country_ids[record_id]])
+
+
+class SnapshotReader:
+    """Memory-mapped snapshot file with typed access to its sections"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as snapshot_file:
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        magic, version, section_count, byte_order = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a CultureBot snapshot (version {FORMAT_VERSION})")
+        if byte_order != BYTE_ORDERS[sys.byteorder]:
+            raise ValueError(f"{path} was built on a machine with a different byte order")
+
+        self.sections: Dict[str, Tuple[int, int]] = {}
+        for entry in range(section_count):
+            name, offset, length = SECTION_ENTRY.unpack_from(self._mmap, HEADER.size + entry * SECTION_ENTRY.size)
+            self.sections[name.rstrip(b"\x00").decode("ascii")] = (offset, length)
+
+        self.strings = StringTable(self.array("strings.offsets", 'Q'), self.array("strings.data", 'B'))
+        self.meta = json.loads(bytes(self.array("meta", 'B')))
+
+    def array(self, name: str, typecode: str) -> memoryview:
+        offset, length = self.sections[name]
+        return self._view[offset:offset + length].cast(typecode)
+
+    def posting_map(self, name: str, typecode: str = 'I', values: Optional[str] = None) -> PostingMap:
+        keys = SortedKeys(self.array(f"{name}.keys", 'I'), self.strings)
+        return PostingMap(keys, self.array(f"{name}.offsets", 'I'), self.array(values or f"{name}.values", typecode))
+
+
+def load_snapshot(path: str) -> KnowledgeStore:
+    """Open a snapshot as a read-only knowledge store with its prebuilt fact index"""
+    reader = SnapshotReader(path)
+
+    store = KnowledgeStore()
+    store.strings = reader.strings
+    store.kind_ids = reader.array("records.kind", 'B')
+    for column in ("country", "category", "text", "source"):
+        setattr(store, f"{column}_ids", reader.array(f"records.{column}", 'I'))
+    store.records = SnapshotRecords(reader.strings, store.country_ids, reader.array("records.payload", 'I'))
+    store.by_kind = reader.posting_map("by_kind")
+    store.by_country = reader.posting_map("by_country")
+    store.by_category = reader.posting_map("by_category")
+
+    index = InvertedIndex()
+    index.postings = reader.posting_map("index.postings")
+    index.term_freqs = reader.posting_map("index.postings", 'H', values="index.term_freqs")
+    index.terms = index.postings.keys_sequence
+    index.doc_lengths = reader.array("index.doc_lengths", 'I')
+    index.total_length = reader.meta["total_length"]
+    index.country_map = reader.posting_map("index.country_map")
+    index.category_map = reader.posting_map("index.category_map")
+    index.read_only = True
+    store.fact_index = index
+    store.read_only = True
+
+    return store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SNAPSHOT_PATH
+    write_snapshot(KnowledgeStore(CULTURAL_DATA), output_path)
+    print(f"Wrote snapshot to {output_path}")
@@ -0,0 +1,111 @@
+"""
+Spelling Corrector for CultureBot
+SymSpell-style deletion dictionary that maps misspelled query words to known vocabulary
+
+Every known word is stored under each string reachable from it by deleting up to
+MAX_EDIT_DISTANCE characters. A misspelling is looked up through its own deletions,
+so only a handful of candidates ever have their edit distance computed.
+"""
+
+from typing import Dict, List, Optional, Set
+
+MAX_EDIT_DISTANCE = 2
+
+# Shorter words are left alone; at two or three letters almost anything is one edit away
+MIN_CORRECTION_LENGTH = 4
+
+# Everyday words a question may use that the cultural data itself might not; knowing them
+# keeps them from being "corrected" into data words
+COMMON_WORDS = frozenset({
+    "about", "after", "again", "also", "always", "another", "anything", "around", "back",
+    "because", "been", "before", "being", "between", "both", "bring", "came", "come", "could",
+    "countries", "country", "cultural", "culture", "cultures", "does", "doing", "done",
+    "during", "each", "either", "else", "enough", "even", "ever", "every", "everyone",
+    "example", "explain", "fall", "fast", "from", "give", "going", "good", "have", "having",
+    "help", "here", "into", "just", "kids", "kind", "kinds", "know", "like", "local", "locals",
+    "make", "many", "more", "most", "much", "must", "need", "never", "other", "others", "over",
+    "pair", "pairs", "parties", "party", "people", "person", "please", "really", "same",
+    "shorts", "should", "show", "some", "something", "such", "sure", "take", "tell", "than",
+    "thank", "thanks", "that", "their", "them", "then", "there", "these", "they", "thing",
+    "things", "think", "this", "those", "through", "time", "times", "today", "under", "until",
+    "usually", "very", "want", "wear", "wearing", "were", "what", "when", "where", "which",
+    "while", "will", "with", "without", "would", "year", "years", "your",
+})
+
+
+def _deletes(word: str, distance: int) -> Set[str]:
+    """All strings made by deleting up to `distance` characters from a word"""
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        results |= frontier
+    return results
+
+
+def edit_distance(source: str, target: str) -> int:
+    """Edit distance that counts an adjacent transposition ("Germnay") as a single edit"""
+    before_previous_row: List[int] = []
+    previous_row: List[int] = []
+    row = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        before_previous_row, previous_row, row = previous_row, row, [i] + [0] * len(target)
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and source[i - 1] == target[j - 2] and source[i - 2] == target[j - 1]:
+                row[j] = min(row[j], before_previous_row[j - 2] + 1)
+    return row[-1]
+
+
+def is_slip(word: str, correction: str) -> bool:
+    """Whether a correction only restores one dropped letter or swaps two adjacent ones
+
+    These are the typos of someone who knows the spelling ("Germny", "Itlay"); a changed,
+    extra or leading letter more often spells a different word ("kids" and "kiss").
+    """
+    if word[:1] != correction[:1] or edit_distance(word, correction) != 1:
+        return False
+    return len(correction) == len(word) + 1 or sorted(correction) == sorted(word)
+
+
+class SpellingCorrector:
+    """Deletion dictionary over a word vocabulary with occurrence counts"""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.deletes: Dict[str, List[str]] = {}
+
+    def add(self, word: str, count: int = 1) -> None:
+        """Add a word to the vocabulary, or raise its count if already known"""
+        if word in self.counts:
+            self.counts[word] += count
+            return
+        self.counts[word] = count
+        for variant in _deletes(word, MAX_EDIT_DISTANCE):
+            self.deletes.setdefault(variant, []).append(word)
+
+    def lookup(self, word: str) -> Optional[str]:
+        """Get the closest known word, preferring the more common one on ties, or None"""
+        if word in self.counts:
+            return word
+        if len(word) < MIN_CORRECTION_LENGTH:
+            return None
+
+        # Allow one edit for short words and two for longer ones
+        max_distance = 1 if len(word) <= 5 else MAX_EDIT_DISTANCE
+        best = None
+        best_key = None
+        seen: Set[str] = set()
+        for variant in _deletes(word, max_distance):
+            for candidate in self.deletes.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate)
+                if distance > max_distance:
+                    continue
+                key = (distance, -self.counts[candidate], candidate)
+                if best_key is None or key < best_key:
+                    best, best_key = candidate, key
+        return best